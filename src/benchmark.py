@@ -0,0 +1,580 @@
+import ast
+import json
+import multiprocessing
+import os
+import platform
+import re
+import tempfile
+import time
+import tracemalloc
+import zlib
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+import pandas as pd
+import src.fetching as fetch
+import src.cache as cache
+import src.cleaning as clean
+import src.spatial as spatial
+
+
+
+queries = clean.categories
+
+
+
+def stub_venues (query, lat, lon, radius, limit=10, spacing=0.002):
+
+    # This function returns the fake venues of a query within 'radius' meters of the given coordinates, with the same nesting as the Foursquare Places API results.
+    # The venues sit on a fixed grid of 'spacing' degrees and a grid point holds a venue of the query when its hash is a multiple of 4, so every search sees the same world.
+    # The venues are sorted by distance and truncated to 'limit', like the API does.
+    span = radius / 111320 + spacing
+    rows = np.arange(np.floor((lat - span) / spacing), np.ceil((lat + span) / spacing) + 1)
+    cols = np.arange(np.floor((lon - span / np.cos(np.radians(lat))) / spacing), np.ceil((lon + span / np.cos(np.radians(lat))) / spacing) + 1)
+    rows, cols = (x.ravel().astype(np.int64) for x in np.meshgrid(rows, cols))
+    keep = (rows * 73856093 ^ cols * 19349663 ^ zlib.crc32(query.encode())) % 4 == 0
+    rows, cols = rows[keep], cols[keep]
+    distance = fetch.haversine(lat, lon, rows * spacing, cols * spacing)
+    order = np.argsort(distance, kind="stable")
+    order = order[distance[order] <= radius][:limit]
+
+    return [{"fsq_id": f"{query}_{rows[i]}_{cols[i]}",
+             "distance": int(round(distance[i])),
+             "geocodes": {"main": {"latitude": rows[i] * spacing, "longitude": cols[i] * spacing}}} for i in order]
+
+
+
+class StubHandler (BaseHTTPRequestHandler):
+
+    # This class answers the requests of the stub Foursquare server: every request sleeps the latency of the server before answering,
+    # to simulate the network round trip, and returns the fake venues of stub_venues around the requested coordinates.
+    # It answers 401 to the token "invalid", and 429 to the first request of each search of the query "throttled", to exercise the error handling of the fetch.
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET (self):
+        params = parse_qs(urlparse(self.path).query)
+        lat, lon = (float(x) for x in params["ll"][0].split(","))
+        limit = int(params.get("limit", [10])[0])
+        time.sleep(self.server.latency)
+        if self.headers.get("Authorization") == "invalid":
+            self.answer(401, {"message": "Invalid request token."})
+        elif params["query"][0] == "throttled" and self.path not in self.server.throttled:
+            self.server.throttled.add(self.path)
+            self.answer(429, {"message": "Quota exceeded."}, {"Retry-After": "0"})
+        else:
+            self.answer(200, {"results": stub_venues(params["query"][0], lat, lon, float(params["radius"][0]), limit)})
+
+    def answer (self, status, payload, headers={}):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message (self, *args):
+        pass
+
+
+
+def serve_stub (latency, ready):
+
+    # This code runs the stub Foursquare server until its process is terminated, after sending its port through the 'ready' queue.
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.throttled = set()
+    ready.put(server.server_port)
+    server.serve_forever()
+
+
+
+@contextmanager
+def stub_server (latency=0.05):
+
+    # This code starts a local threaded HTTP server that stands in for "api.foursquare.com/v3/places/search", with 'latency' seconds per request.
+    # The server runs in its own process, so it does not compete with the pipeline being measured for the GIL.
+    # Yields the search url of the server and stops it when the block ends.
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve_stub, args=(latency, ready), daemon=True)
+    process.start()
+    try:
+        yield f"http://127.0.0.1:{ready.get(timeout=60)}/v3/places/search"
+    finally:
+        process.terminate()
+        process.join()
+
+
+
+def bench_fetch_concurrency (n_offices=25, latency=0.05, levels=(1, 2, 4, 8, 16)):
+
+    # This function fetches the four categories for 'n_offices' random offices against the stub server once per concurrency level.
+    # Returns a DataFrame with the wall-clock time of each level and its speedup over the first one.
+    rng = np.random.default_rng(0)
+    coords = list(zip(rng.uniform(40.70, 40.80, n_offices), rng.uniform(-74.02, -73.93, n_offices)))
+    rows = []
+    with stub_server(latency) as url:
+        for workers in levels:
+            start = time.perf_counter()
+            fetch.fetch_venues(coords, queries, "stub", max_workers=workers, url=url)
+            rows.append({"max_workers": workers, "seconds": time.perf_counter() - start})
+    df = pd.DataFrame(rows)
+    df['speedup'] = df['seconds'].iloc[0] / df['seconds']
+
+    return df
+
+
+
+def bench_cache (path="data/df_api.csv", latency=0.05, max_workers=8):
+
+    # This function fetches the four categories for the offices of the saved pipeline output twice against the stub server, through a new temporary VenueCache.
+    # The first run is cold (every search is a miss) and the second one is warm (every search is a hit).
+    # Returns a DataFrame with the wall-clock time and the cache counters of each run.
+    df = pd.read_csv(path)
+    coords = list(zip(df['offices_latitude'], df['offices_longitude']))
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp, stub_server(latency) as url:
+        venue_cache = cache.VenueCache(os.path.join(tmp, "venue_cache.sqlite"))
+        for run in ["cold", "warm"]:
+            venue_cache.hits, venue_cache.misses = 0, 0
+            start = time.perf_counter()
+            fetch.fetch_venues(coords, queries, "stub", max_workers=max_workers, url=url, cache=venue_cache)
+            rows.append({"run": run, "seconds": time.perf_counter() - start, **venue_cache.stats()})
+        venue_cache.close()
+    df = pd.DataFrame(rows)
+    df['speedup'] = df['seconds'].iloc[0] / df['seconds']
+
+    return df
+
+
+
+def bench_coalescing (paths=("data/df_api.csv", "data/df_mongo.csv"), latency=0.05, radius=500, cell=300, max_workers=8):
+
+    # This function fetches the four categories for the offices of the saved pipeline outputs against the stub server, once per office and once coalesced by cluster.
+    # Checks that both ways give identical per-office counts, and returns the report of the coalesced run with both wall-clock times.
+    df = pd.concat([pd.read_csv(path)[['offices_latitude', 'offices_longitude']] for path in paths], ignore_index=True).dropna()
+    coords = list(zip(df['offices_latitude'], df['offices_longitude']))
+    with stub_server(latency) as url:
+        start = time.perf_counter()
+        naive = fetch.fetch_venues(coords, queries, "stub", radius=radius, max_workers=max_workers, url=url)
+        seconds_naive = time.perf_counter() - start
+        start = time.perf_counter()
+        coalesced, report = fetch.fetch_venues_coalesced(coords, queries, "stub", radius=radius, cell=cell, max_workers=max_workers, url=url)
+        seconds = time.perf_counter() - start
+    report["identical_counts"] = all([len(x) for x in naive[column]] == [len(x) for x in coalesced[column]] for column in queries)
+    report["seconds_naive"], report["seconds"] = seconds_naive, seconds
+
+    return report
+
+
+
+def synthetic_offices (n=1000000, seed=0):
+
+    # This function builds a DataFrame with 'n' rows shaped like the output of mongo_filter, one nested office dictionary per row.
+    rng = np.random.default_rng(seed)
+    states = np.array(["NY", "CA", "FL", "IL", "TX", "WA", "MA", "CO", ""])
+    countries = np.array(["USA"] * 8 + ["GBR", "DEU"])
+    lat, lon = rng.uniform(25, 48, n).round(6), rng.uniform(-124, -67, n).round(6)
+    has_coords = rng.random(n) > 0.1
+    country, state = countries[rng.integers(0, len(countries), n)], states[rng.integers(0, len(states), n)]
+    offices = [{"description": "", "address1": "100 Main St", "address2": "", "zip_code": "10001", "city": "City",
+                "state_code": state[i], "country_code": country[i],
+                "latitude": lat[i] if has_coords[i] else None, "longitude": lon[i] if has_coords[i] else None} for i in range(n)]
+
+    return pd.DataFrame({"name": [f"company {i % 5000}" for i in range(n)], "total_money_raised": "$5M", "offices": offices})
+
+
+
+def legacy_cleaning (df):
+
+    # This code reproduces the per-field 'apply' flattening and the substring filters of the original basic_cleaning_1/2/3, as the reference of bench_flatten.
+    df['offices_country_code'] = df['offices'].apply(lambda x: x['country_code'])
+    top_country = df['offices_country_code'].value_counts().index[0]
+    df = df[df['offices_country_code'].apply(lambda x: top_country in x)].reset_index(drop=True)
+    df['offices_state_code'] = df['offices'].apply(lambda x: x['state_code'])
+    top_states = list(df['offices_state_code'].value_counts().index[:4])
+    df = df[df['offices_state_code'].apply(lambda x: any(val in x for val in top_states))].reset_index(drop=True)
+    df['offices_latitude'] = df['offices'].apply(lambda x: x['latitude'])
+    df['offices_longitude'] = df['offices'].apply(lambda x: x['longitude'])
+    df['offices_address_1'] = df['offices'].apply(lambda x: x['address1'])
+    df['offices_address_2'] = df['offices'].apply(lambda x: x['address2'])
+    df['offices_zip_code'] = df['offices'].apply(lambda x: x['zip_code'])
+    df = df.drop('offices', axis=1).replace('', np.nan)
+    df = df.dropna(subset=['offices_latitude', 'offices_longitude', 'offices_address_1', 'offices_address_2'], how='all').reset_index(drop=True)
+
+    return df
+
+
+
+def bench_flatten (n=1000000):
+
+    # This function runs the legacy cleaning and basic_cleaning_1/2/3 on the same synthetic frame of 'n' offices.
+    # Returns a DataFrame with the wall-clock time, the number of rows and the memory of the resulting frame of each version, in total and per column (in MB).
+    df = synthetic_offices(n)
+    rows = []
+    for version, function in [("legacy", legacy_cleaning), ("vectorized", lambda x: clean.basic_cleaning_3(clean.basic_cleaning_2(clean.basic_cleaning_1(x))))]:
+        start = time.perf_counter()
+        result = function(df.copy())
+        memory = result.memory_usage(deep=True, index=False) / 2**20
+        rows.append({"version": version, "seconds": time.perf_counter() - start, "rows": len(result), "memory_mb": memory.sum(), **memory.to_dict()})
+    result = pd.DataFrame(rows)
+    result['speedup'] = result['seconds'].iloc[0] / result['seconds']
+
+    return result
+
+
+
+def bench_spatial (n_venues=100000, n_offices=10000, radii=(250, 500, 750, 1000)):
+
+    # This function builds a VenueIndex over 'n_venues' random venues and counts them around 'n_offices' random offices for a sweep of radii.
+    # Returns the build time, the query time and the query throughput in offices per second.
+    rng = np.random.default_rng(0)
+    lat, lon = rng.uniform(40.55, 40.95, n_venues), rng.uniform(-74.15, -73.75, n_venues)
+    start = time.perf_counter()
+    index = spatial.VenueIndex(lat, lon, max(radii))
+    seconds_build = time.perf_counter() - start
+    start = time.perf_counter()
+    counts = index.count(rng.uniform(40.55, 40.95, n_offices), rng.uniform(-74.15, -73.75, n_offices), radii)
+    seconds_query = time.perf_counter() - start
+
+    return {"venues": n_venues, "offices": n_offices, "radii": len(radii), "seconds_build": seconds_build, "seconds_query": seconds_query,
+            "offices_per_second": n_offices / seconds_query, "mean_count": counts.mean(axis=0).tolist()}
+
+
+
+def bench_storage (path="data/df_api.csv", repeat=5):
+
+    # This function compares loading the saved pipeline output from the CSV (parsing the lists of venues with ast.literal_eval)
+    # with loading the offices and venues tables written by storage.save_results, as Parquet and as memory-mapped Arrow.
+    # Returns the mean load time and the size on disk of each format.
+    import src.storage as storage
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        offices, venues = storage.convert_csv(path, tmp, "parquet")
+        storage.save_results(offices, venues, tmp, "arrow")
+
+        def load_csv ():
+            df = pd.read_csv(path)
+            for column in storage.venue_columns:
+                df[column] = df[column].apply(ast.literal_eval)
+            return df
+
+        for name, load, files in [("csv + literal_eval", load_csv, [path]),
+                                  ("parquet", lambda: storage.load_results(tmp, "parquet"), [os.path.join(tmp, f"{t}.parquet") for t in ["offices", "venues"]]),
+                                  ("arrow (mmap)", lambda: storage.load_results(tmp, "arrow"), [os.path.join(tmp, f"{t}.arrow") for t in ["offices", "venues"]])]:
+            start = time.perf_counter()
+            for _ in range(repeat):
+                load()
+            rows.append({"format": name, "seconds": (time.perf_counter() - start) / repeat, "bytes": sum(os.path.getsize(f) for f in files)})
+
+    return pd.DataFrame(rows)
+
+
+
+def synthetic_subset (n_offices=10000, venues_per_category=10, seed=0):
+
+    # This function builds a DataFrame shaped like the output of subset_function, with 'venues_per_category' venues per category and office.
+    # Neighbouring offices share part of their venues, as they do in the real data.
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({"name": [f"company {i}" for i in range(n_offices)], "offices_state_code": "NY",
+                       "offices_latitude": rng.uniform(40.70, 40.80, n_offices), "offices_longitude": rng.uniform(-74.02, -73.93, n_offices)})
+    for column in queries:
+        ids = rng.integers(0, n_offices * venues_per_category // 2, (n_offices, venues_per_category))
+        df[column] = [[{"fsq_id": f"{column}{j}", "distance": int(j % 500), "geocodes": {"main": {"latitude": 40.70 + (j % 1000) * 1e-4, "longitude": -74.02 + (j // 1000) * 1e-4}}} for j in row] for row in ids]
+        df[f"num_{column}"] = venues_per_category
+
+    return df
+
+
+
+def legacy_explode (df_subset, column):
+
+    # This code reproduces one of the original explode_* functions (row-wise pre_explode, explode, one pd.Series per venue and drop_duplicates on tuples), as the reference of bench_explode.
+    df = df_subset[['name', 'offices_state_code', 'offices_latitude', 'offices_longitude', column, f'num_{column}']].copy()
+    df[f'{column}_coord'] = df.apply(lambda row: clean.pre_explode(row, column), axis=1)
+    df = df.explode(f'{column}_coord').reset_index(drop=True)
+    df[['latitude', 'longitude']] = df[f'{column}_coord'].apply(lambda x: pd.Series([x[0], x[1]]))
+    df = df.drop_duplicates(subset=f'{column}_coord', keep='first')
+
+    return df
+
+
+
+def bench_explode (n_offices=2000, venues_per_category=10):
+
+    # This function explodes the venues of a synthetic subset with the four legacy explode_* functions and with explode_venues.
+    # Returns a DataFrame with the wall-clock time and the number of venue rows of each version.
+    df = synthetic_subset(n_offices, venues_per_category)
+    rows = []
+    start = time.perf_counter()
+    n = sum(len(legacy_explode(df, column)) for column in queries)
+    rows.append({"version": "legacy", "seconds": time.perf_counter() - start, "rows": n})
+    start = time.perf_counter()
+    n = len(clean.explode_venues(df))
+    rows.append({"version": "explode_venues", "seconds": time.perf_counter() - start, "rows": n})
+    result = pd.DataFrame(rows)
+    result['speedup'] = result['seconds'].iloc[0] / result['seconds']
+
+    return result
+
+
+
+def bench_map (sizes=(1000, 10000, 100000), modes=("markers", "cluster", "geojson"), max_markers=10000):
+
+    # This function renders the map of map_plot for synthetic sets of venues of each size and each mode, and the static image of static_plot.
+    # Returns a DataFrame with the generation time (building the map and rendering its HTML) and the size of the HTML of each run.
+    # The "markers" mode is skipped above 'max_markers' venues, since it takes minutes there.
+    import matplotlib.pyplot as plt
+    import src.visualization as viz
+    rng = np.random.default_rng(0)
+    offices = pd.DataFrame({"offices_latitude": rng.uniform(40.70, 40.80, 5), "offices_longitude": rng.uniform(-74.02, -73.93, 5)})
+    rows = []
+    for n in sizes:
+        near_office = pd.DataFrame({"latitude": rng.uniform(40.70, 40.80, n), "longitude": rng.uniform(-74.02, -73.93, n),
+                                    "category_name": rng.choice(list(viz.category_styles), n)})
+        for mode in modes:
+            if mode == "markers" and n > max_markers:
+                continue
+            start = time.perf_counter()
+            html = viz.map_plot(offices, near_office, mode=mode).get_root().render()
+            rows.append({"venues": n, "mode": mode, "seconds": time.perf_counter() - start, "bytes": len(html.encode())})
+        with tempfile.TemporaryDirectory() as tmp:
+            start = time.perf_counter()
+            plt.close(viz.static_plot(offices, near_office, path=os.path.join(tmp, "map.png")))
+            rows.append({"venues": n, "mode": "static", "seconds": time.perf_counter() - start, "bytes": os.path.getsize(os.path.join(tmp, "map.png"))})
+
+    return pd.DataFrame(rows)
+
+
+
+def bench_geocode (n_offices=100000, n_addresses=5000, missing=0.3):
+
+    # This function backfills the coordinates of 'n_offices' synthetic offices, a fraction 'missing' of them without coordinates and sharing 'n_addresses' distinct addresses,
+    # with a local stub geocoder and a new temporary cache. The first run is cold (the stub geocodes every distinct address once) and the second one is answered from the cache.
+    # Returns a DataFrame with the wall-clock time, the number of addresses sent to the geocoder and the number of offices left without coordinates of each run.
+    import src.geocoding as geo
+    rng = np.random.default_rng(0)
+    address = rng.integers(0, n_addresses, n_offices)
+    df = pd.DataFrame({"offices_address_1": [f"{i} Main St." for i in address], "offices_address_2": "",
+                       "offices_zip_code": [f"{10000 + i % 90000:05d}" for i in address],
+                       "offices_latitude": rng.uniform(25, 48, n_offices), "offices_longitude": rng.uniform(-124, -67, n_offices)})
+    df.loc[rng.random(n_offices) < missing, ['offices_latitude', 'offices_longitude']] = np.nan
+    sent = []
+
+    def stub_geocoder (addresses):
+        sent.append(len(addresses))
+        number = addresses['offices_address_1'].str.extract(r'(\d+)', expand=False).astype('float64')
+        return pd.DataFrame({"latitude": 25 + number / n_addresses * 23, "longitude": -124 + number / n_addresses * 57}, index=addresses.index)
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for run in ["cold", "warm"]:
+            sent.clear()
+            start = time.perf_counter()
+            result = geo.backfill_coordinates(df, geocoder=stub_geocoder, cache_path=os.path.join(tmp, "geocode_cache.sqlite"))
+            rows.append({"run": run, "seconds": time.perf_counter() - start, "geocoded": sum(sent), "still_missing": int(result['offices_latitude'].isna().sum())})
+
+    return pd.DataFrame(rows)
+
+
+
+class StubCollection:
+
+    # This class is a minimal in-memory stand-in of the MongoDB "companies" collection, enough for mongo_filter and mongo_stream:
+    # find() supports the "$and" of "$regex" and "$gt" conditions of their queries and an inclusion projection, and the cursor supports batch_size(), sort() and close().
+    # The documents without an _id get their position as _id.
+
+    def __init__ (self, docs):
+        self.docs = [doc if "_id" in doc else {"_id": i, **doc} for i, doc in enumerate(docs)]
+
+
+    def matches (self, doc, query):
+        if "$and" in query:
+            return all(self.matches(doc, condition) for condition in query["$and"])
+        for field, condition in query.items():
+            if "$gt" in condition and not (field in doc and doc[field] > condition["$gt"]):
+                return False
+            if "$regex" in condition and not (isinstance(doc.get(field), str) and re.search(condition["$regex"], doc[field])):
+                return False
+        return True
+
+
+    def find (self, query=None, projection=None):
+        fields = [field for field, keep in (projection or {}).items() if keep]
+        docs = (doc for doc in self.docs if self.matches(doc, query or {}))
+        return StubCursor({field: doc[field] for field in fields if field in doc} if fields else dict(doc) for doc in docs)
+
+
+
+class StubCursor:
+
+    # This class wraps the generator of documents of StubCollection.find, so it can be iterated like a pymongo cursor.
+
+    def __init__ (self, docs):
+        self.docs = docs
+
+
+    def batch_size (self, size):
+        return self
+
+
+    def sort (self, field, direction=1):
+        self.docs = iter(sorted(self.docs, key=lambda doc: doc[field], reverse=direction < 0))
+        return self
+
+
+    def close (self):
+        pass
+
+
+    def __iter__ (self):
+        return iter(self.docs)
+
+
+
+cities = [("NY", 40.75, -73.99, "100"), ("CA", 37.78, -122.41, "941"), ("CA", 34.05, -118.25, "900"), ("FL", 25.77, -80.19, "331"),
+          ("IL", 41.88, -87.63, "606"), ("TX", 30.27, -97.74, "787"), ("WA", 47.61, -122.33, "981"), ("MA", 42.36, -71.06, "021")]
+
+def synthetic_companies (n=1000, seed=0):
+
+    # This function generates 'n' documents shaped like the "companies" collection, with 1 to 3 offices each spread around a few US cities and some foreign ones.
+    # About half of them match the query of mongo_filter, and some offices have no coordinates, so that insert_coordinates has work to do.
+    rng = np.random.default_rng(seed)
+    docs = []
+    for i in range(n):
+        offices = []
+        for j in range(rng.integers(1, 4)):
+            state, lat, lon, zip_prefix = cities[rng.integers(0, len(cities))]
+            foreign = rng.random() < 0.1
+            has_coords = rng.random() > 0.15
+            offices.append({"description": "", "address1": f"{rng.integers(1, 999)} Main St", "address2": "", "zip_code": f"{zip_prefix}{rng.integers(0, 99):02d}",
+                            "city": "", "state_code": None if foreign else state, "country_code": "GBR" if foreign else "USA",
+                            "latitude": float(lat + rng.normal(0, 0.03)) if has_coords else None,
+                            "longitude": float(lon + rng.normal(0, 0.03)) if has_coords else None})
+        docs.append({"name": f"company {i}", "total_money_raised": f"${rng.integers(1, 99)}{'M' if rng.random() < 0.7 else 'k'}",
+                     "tag_list": "design, web" if rng.random() < 0.7 else "web", "offices": offices})
+
+    return docs
+
+
+
+def run_suite (n_companies=1000, latency=0.01, max_workers=16, map_mode="cluster", trace_memory=True, output="bench_results.json"):
+
+    # This function runs the whole pipeline on 'n_companies' synthetic companies, against StubCollection and the stub Foursquare server (with 'latency' seconds per request),
+    # and measures every stage: extraction, the cleaning steps, venue fetch, scoring, explode and map render.
+    # For each stage it records the wall-clock time, the rows in and out and, with 'trace_memory', the peak memory allocated (tracemalloc, which slows the run down).
+    # Writes the results with the parameters of the run to 'output' as JSON, to compare versions with compare_results, and returns them.
+    import src.visualization as viz
+    c = StubCollection(synthetic_companies(n_companies))
+    stages = []
+
+    def measure (name, function, df):
+        rows_in = len(df) if df is not None else n_companies
+        if trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        result = function(df)
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+        if trace_memory:
+            tracemalloc.stop()
+        stages.append({"stage": name, "seconds": seconds, "rows_in": rows_in, "rows_out": len(result) if isinstance(result, pd.DataFrame) else None, "peak_memory_bytes": peak})
+        return result
+
+    with stub_server(latency) as url:
+        df = measure("extraction", lambda _: clean.mongo_filter(c), None)
+        df = measure("basic_cleaning_1", clean.basic_cleaning_1, df)
+        df = measure("basic_cleaning_2", clean.basic_cleaning_2, df)
+        df = measure("basic_cleaning_3", clean.basic_cleaning_3, df)
+        df = measure("insert_coordinates", lambda x: clean.insert_coordinates(x, cache_path=None), df)
+        df = measure("venue_fetch", lambda x: clean.matching_companies(x, max_workers=max_workers, url=url), df)
+    df = measure("scoring", clean.final_punctuation, df)
+    df_subset = measure("subset", lambda x: clean.subset_function(x, k=5), df)
+    near_office = measure("explode", clean.explode_venues, df_subset)
+    measure("map_render", lambda x: viz.map_plot(df_subset, x, mode=map_mode).get_root().render(), near_office)
+
+    results = {"params": {"n_companies": n_companies, "latency": latency, "max_workers": max_workers, "map_mode": map_mode, "trace_memory": trace_memory},
+               "python": platform.python_version(), "pandas": pd.__version__, "numpy": np.__version__, "stages": stages}
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    return results
+
+
+
+def compare_results (old="bench_results_old.json", new="bench_results.json"):
+
+    # This function compares two result files of run_suite stage by stage.
+    # Returns a DataFrame with the time and peak memory of both versions and their ratio (new / old), so a ratio well above 1 is a regression.
+    frames = []
+    for path in [old, new]:
+        with open(path) as f:
+            frames.append(pd.DataFrame(json.load(f)["stages"]).set_index("stage")[["seconds", "peak_memory_bytes"]])
+    df = frames[0].join(frames[1], lsuffix="_old", rsuffix="_new", how="outer")
+    df["seconds_ratio"] = df["seconds_new"] / df["seconds_old"]
+    df["memory_ratio"] = df["peak_memory_bytes_new"] / df["peak_memory_bytes_old"]
+
+    return df
+
+
+
+def bench_incremental (n_companies=1000, changed=0.02, latency=0.01, max_workers=16):
+
+    # This function runs incremental_matching twice on the cleaned offices of 'n_companies' synthetic companies against the stub server:
+    # a first full run, and a refresh after a fraction 'changed' of the offices has moved.
+    # Returns a DataFrame with the wall-clock time and the report of each run.
+    import src.incremental as incremental
+    c = StubCollection(synthetic_companies(n_companies))
+    df = clean.insert_coordinates(clean.basic_cleaning_3(clean.basic_cleaning_2(clean.basic_cleaning_1(clean.mongo_filter(c)))), cache_path=None)
+    moved = np.random.default_rng(0).random(len(df)) < changed
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp, stub_server(latency) as url:
+        for run, offices in [("full", df), ("refresh", df.assign(offices_latitude=df['offices_latitude'] + moved * 0.01))]:
+            start = time.perf_counter()
+            result = incremental.incremental_matching(offices.copy(), os.path.join(tmp, "state.pkl"), url=url, max_workers=max_workers)
+            rows.append({"run": run, "seconds": time.perf_counter() - start, **result.attrs['incremental_report']})
+
+    return pd.DataFrame(rows)
+
+
+
+def bench_partitioned (n_companies=2000, latency=0.01, levels=(1, 2, 4, 8), max_workers=8, k=5):
+
+    # This function runs partitioned.run_partitioned on the offices of 'n_companies' synthetic companies (all their states) against the stub server,
+    # once per number of worker processes in 'levels', and checks that every run selects the same top 'k' offices.
+    # Returns a DataFrame with the wall-clock time and speedup of each level. The speedup is bounded by the number of cores and of states (shards).
+    import src.partitioned as partitioned
+    c = StubCollection(synthetic_companies(n_companies))
+    df = clean.basic_cleaning_1(clean.mongo_filter(c))
+    rows, best = [], None
+    with stub_server(latency) as url:
+        for workers in levels:
+            start = time.perf_counter()
+            scored, df_subset, near_office = partitioned.run_partitioned(df.copy(), k=k, workers=workers, url=url, max_workers=max_workers)
+            rows.append({"workers": workers, "seconds": time.perf_counter() - start, "offices": len(scored), "venues": len(near_office)})
+            best = best if best is not None else list(df_subset['office_uid'])
+            rows[-1]["same_top_k"] = best == list(df_subset['office_uid'])
+    result = pd.DataFrame(rows)
+    result['speedup'] = result['seconds'].iloc[0] / result['seconds']
+
+    return result
+
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Run the end-to-end benchmark suite on synthetic data with stub MongoDB and Foursquare services.")
+    parser.add_argument("--companies", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.01)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--map-mode", default="cluster")
+    parser.add_argument("--no-memory", action="store_true")
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args()
+    results = run_suite(args.companies, args.latency, args.workers, args.map_mode, not args.no_memory, args.output)
+    print(pd.DataFrame(results["stages"]).to_string(index=False))
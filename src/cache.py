@@ -0,0 +1,100 @@
+import json
+import sqlite3
+import time
+from urllib.parse import unquote
+
+
+
+class CacheMiss (KeyError):
+
+    # This exception is raised by a cache in "replay only" mode when a venue search has not been stored yet.
+    pass
+
+
+
+class VenueCache:
+
+    # This class stores the results of the Foursquare venue searches in a SQLite file, so re-running the pipeline does not hit the API again.
+    # Each entry is keyed on the normalized query, the coordinates rounded to 'precision' decimals and the radius.
+    # Entries older than 'ttl' seconds are treated as missing, and once there are more than 'max_entries' the least recently used ones are evicted.
+    # With 'offline' set to True nothing is fetched: any search that is not in the cache raises CacheMiss.
+
+    def __init__ (self, path="data/venue_cache.sqlite", ttl=30 * 24 * 3600, max_entries=100000, precision=5, offline=False):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.precision = precision
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self.con = sqlite3.connect(path)
+        self.con.execute("CREATE TABLE IF NOT EXISTS venues (key TEXT PRIMARY KEY, results TEXT, created REAL, accessed REAL)")
+        self.con.execute("CREATE INDEX IF NOT EXISTS venues_accessed ON venues (accessed)")
+        self.con.commit()
+        self.entries = self.con.execute("SELECT COUNT(*) FROM venues").fetchone()[0]
+
+
+    def key (self, venue, lat, lon, radius):
+
+        # This code builds the cache key: the query is unquoted, stripped and lower-cased, and the coordinates are rounded to 'precision' decimals.
+        query = unquote(str(venue)).strip().lower()
+        return f"{query}|{round(float(lat), self.precision):.{self.precision}f}|{round(float(lon), self.precision):.{self.precision}f}|{int(radius)}"
+
+
+    def get (self, venue, lat, lon, radius):
+
+        # This code returns the stored list of venues, or None when the entry is missing or has expired.
+        # Refreshes the access time of the entry so the LRU eviction keeps it, and updates the hit/miss counters.
+        key = self.key(venue, lat, lon, radius)
+        row = self.con.execute("SELECT results, created FROM venues WHERE key = ?", (key,)).fetchone()
+        now = time.time()
+        if row is None or (self.ttl is not None and now - row[1] > self.ttl):
+            self.misses += 1
+            if self.offline:
+                raise CacheMiss(key)
+            return None
+        self.hits += 1
+        self.con.execute("UPDATE venues SET accessed = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+
+    def put (self, venue, lat, lon, radius, results):
+
+        # This code stores the list of venues and evicts the least recently used entries above 'max_entries'.
+        # The number of entries is kept in 'self.entries' (counted once when the cache is opened), so a put does not count the whole table.
+        now = time.time()
+        key = self.key(venue, lat, lon, radius)
+        updated = self.con.execute("UPDATE venues SET results = ?, created = ?, accessed = ? WHERE key = ?", (json.dumps(results), now, now, key)).rowcount
+        if not updated:
+            self.con.execute("INSERT INTO venues VALUES (?, ?, ?, ?)", (key, json.dumps(results), now, now))
+            self.entries += 1
+        self.evict()
+
+
+    def evict (self):
+
+        # This code deletes the entries with the oldest access time until the cache holds at most 'max_entries' entries.
+        if self.max_entries is None:
+            return
+        excess = self.entries - self.max_entries
+        if excess > 0:
+            self.entries -= self.con.execute("DELETE FROM venues WHERE key IN (SELECT key FROM venues ORDER BY accessed LIMIT ?)", (excess,)).rowcount
+
+
+    def stats (self):
+
+        # This code returns the hit/miss counters, the hit rate and the number of stored entries.
+        total = self.hits + self.misses
+        size = self.con.execute("SELECT COUNT(*) FROM venues").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0, "entries": size}
+
+
+    def commit (self):
+
+        # This code writes the pending puts and access times to disk, once per batch of searches instead of once per search.
+        self.con.commit()
+
+
+    def close (self):
+        self.con.commit()
+        self.con.close()
@@ -1,16 +1,30 @@
 import pandas as pd
 import numpy as np
-import requests
 import json
 from getpass import getpass
-from dotenv import load_dotenv
 import os
 import ast
+from itertools import chain
+import src.fetching as fetch
+import src.scoring as score
+import src.geocoding as geo
+import src.extraction as extraction
 
 
 
-load_dotenv()
-token = os.getenv("token")
+token = None
+
+def get_token ():
+
+    # This function returns the Foursquare token of the "token" environment variable, loading the .env file the first time it is needed instead of when the module is imported.
+    global token
+    if token is None:
+        from dotenv import load_dotenv
+        load_dotenv()
+        token = os.getenv("token")
+
+    return token
+
 
 
 def mongo_filter (c):
@@ -34,16 +48,61 @@ def mongo_filter (c):
 
 
 
+def to_category (values):
+
+    # This function turns an array of codes into a categorical, factorizing them once and treating empty strings as missing values.
+    codes, uniques = pd.factorize(values)
+    codes[np.isin(codes, np.flatnonzero(uniques == ''))] = -1
+
+    return pd.Categorical.from_codes(codes, uniques)
+
+
+
+def flatten_offices (offices):
+
+    # This function flattens the nested office dictionaries into one column per field (see office_fields in src/extraction.py),
+    # reading all the fields of every dictionary in a single pass (the DataFrame constructor on the list of dictionaries) instead of one 'apply' per field.
+    # Empty strings become missing values, latitude and longitude are typed as float64, the country and state codes as categoricals, which take much less memory than strings,
+    # and the address and zip code as the pandas string dtype with NaN as missing value (an object column of None takes three times as much memory).
+    records = [o if isinstance(o, dict) else {} for o in offices]
+    values = pd.DataFrame(records, columns=list(extraction.office_fields.values()), dtype=object)
+    flat = {}
+    for column, key in extraction.office_fields.items():
+        field = values[key].to_numpy(dtype=object, copy=True)
+        if column in ('offices_country_code', 'offices_state_code'):
+            flat[column] = to_category(field)
+        elif column in ('offices_latitude', 'offices_longitude'):
+            try:
+                flat[column] = field.astype('float64')
+            except (TypeError, ValueError):
+                flat[column] = pd.to_numeric(pd.Series(field).replace('', np.nan), errors='coerce').astype('float64').to_numpy()
+        else:
+            field[pd.isna(field) | (field == '')] = np.nan
+            flat[column] = pd.array(field, dtype=pd.StringDtype(na_value=np.nan))
+    flat = pd.DataFrame(flat, index=offices.index)
+
+    return flat
+
+
+
+def add_office_columns (df):
+
+    # This code adds the flattened office columns (see flatten_offices) to the DataFrame, unless a previous cleaning step has already added them.
+    if 'offices_country_code' not in df.columns:
+        df = pd.concat([df, flatten_offices(df['offices'])], axis=1)
+
+    return df
+
+
+
 def basic_cleaning_1 (df):
    
-    # This code creates a new column with the value of the country_code key from the offices column of each row. 
-    # Counts each unique value in the offices_country_code column and stores the result in a dictionary named value_counts_offices_country. 
-    # Creates a list of tuples from the dictionary, and filters the DataFrame to include only rows that contains the most frequent country code. 
+    # This code flattens the fields of the offices column of each row into new columns, including offices_country_code. 
+    # Counts each unique value in the offices_country_code column and filters the DataFrame to include only rows with the most frequent country code. 
     # Resets the DataFrame's index so that it starts at 0 and increments by 1 for each row.
-    df['offices_country_code'] = df['offices'].apply(lambda x: x['country_code'])
-    value_counts_offices_country = df['offices_country_code'].value_counts().to_dict()
-    value_counts_offices_country_tup = list(value_counts_offices_country.items())
-    df = df[df['offices_country_code'].apply(lambda x: value_counts_offices_country_tup[0][0] in x)]
+    df = add_office_columns(df)
+    top_country = df['offices_country_code'].value_counts().index[:1]
+    df = df[df['offices_country_code'].isin(top_country)]
     df = df.reset_index(drop=True)
 
     return df
@@ -52,14 +111,12 @@ def basic_cleaning_1 (df):
 
 def basic_cleaning_2 (df):
 
-    # This code creates a new column with the value of the state_code key from the offices column of each row. 
-    # Counts each unique value in the offices_state_code column and stores the result in a Pandas Series named value_counts_offices_state_code. 
-    # Creates a list of tuples from the series, and filters the DataFrame to include only rows that contains any of the top four most frequent state codes. 
+    # This code counts each unique value in the offices_state_code column (flattened from the offices column if needed).
+    # Filters the DataFrame to include only rows with any of the top four most frequent state codes. 
     # Resets the DataFrame's index so that it starts at 0 and increments by 1 for each row.
-    df['offices_state_code'] = df['offices'].apply(lambda x : x['state_code'])
-    value_counts_offices_state_code = df['offices_state_code'].value_counts()
-    value_counts_offices_state_code_tup = list(value_counts_offices_state_code.items())
-    df = df[df['offices_state_code'].apply(lambda x: any(val in x for val in [value_counts_offices_state_code_tup[0][0],value_counts_offices_state_code_tup[1][0], value_counts_offices_state_code_tup[2][0], value_counts_offices_state_code_tup[3][0]]))]
+    df = add_office_columns(df)
+    top_states = df['offices_state_code'].value_counts().index[:4]
+    df = df[df['offices_state_code'].isin(top_states)]
     df = df.reset_index(drop=True)
 
     return df
@@ -68,12 +125,8 @@ def basic_cleaning_2 (df):
 
 def basic_cleaning_3 (df):
 
-    # This code adds new columns to the DataFrame df containing the latitude, longitude, address line 1, address line 2, and zip code of the offices.
-    df['offices_latitude'] = df['offices'].apply(lambda x : x['latitude'])
-    df['offices_longitude'] = df['offices'].apply(lambda x : x['longitude'])
-    df['offices_address_1'] = df['offices'].apply(lambda x : x['address1'])
-    df['offices_address_2'] = df['offices'].apply(lambda x : x['address2'])
-    df['offices_zip_code'] = df['offices'].apply(lambda x : x['zip_code'])
+    # This code makes sure the DataFrame df contains the latitude, longitude, address line 1, address line 2, and zip code of the offices.
+    df = add_office_columns(df)
 
     # This code drops the 'offices' column
     # Replaces empty strings with NaN values
@@ -88,32 +141,17 @@ def basic_cleaning_3 (df):
 
 
 
-def insert_coordinates (df):
+def insert_coordinates (df, centroids=None, geocoder=None, cache_path=None):
    
-    # This code code creates a subset of the dataframe where latitude and longitude values are missing. 
-    # Creates a list with the missing coordinates, for latitude and longitude, respectively. Those values have been introduced manually. 
-    # Creates a dictionary from the lists with the missing coordinates and turns it into a dataframe.
-    # Resets the index of the dataframe to be consecutive numbers, all in one line.
-    # Creates a joined dataframe, which is then joined to the original dataframe on the common column index to add the latitude and longitude columns to df.
-    df_subset = df.loc[df['offices_latitude'].isnull(), ['name', 'offices_address_1', 'offices_address_2']]
-    NaN_name_list = df.loc[df['offices_latitude'].isnull(), 'name'].tolist()
-    NaN_lat_list = [40.7493756, 40.7208632, 40.720812, None, 40.7467544, 37.4499108, 37.4433618, 34.080633]
-    NaN_lon_list = [-73.9964352, -74.0035362, -74.0037199, None, -73.9953227, -122.1211875, -122.1630406, -118.3885556]
-    Nan_index_list = [2, 9, 14, 15, 16, 19, 20, 21]
-    my_dict = {key: value for key, value in zip(['name', 'latitude', 'longitude', 'index'], [NaN_name_list, NaN_lat_list, NaN_lon_list, Nan_index_list])}
-    dict_df = pd.DataFrame(my_dict)
-    dict_df.set_index('index', inplace=True)
-    joined_df = df_subset.join(dict_df[['latitude', 'longitude']], on=df_subset.index)
-    df = df.join(joined_df[['latitude', 'longitude']], on=df.index)
-
-    # This code replaces the missing coordinates with the values from of latitude and longitude.
-    df.loc[df['offices_latitude'].isna(), 'offices_latitude'] = df.loc[df['offices_latitude'].isna(), 'latitude']
-    df.loc[df['offices_longitude'].isna(), 'offices_longitude'] = df.loc[df['offices_longitude'].isna(), 'longitude']
-
-    # This code drops the 'latitude' and 'longitude' columns from the dataframe.
-    # Removes any rows that have missing values for 'offices_latitude' or 'offices_longitude'.
-    # Resets the index of the dataframe after dropping the specified columns and rows.
-    df.drop(columns=['latitude', 'longitude'], inplace=True)
+    # This code fills the missing latitude and longitude values from the addresses and zip codes of the offices, in batch (see backfill_coordinates in src/geocoding.py):
+    # first from the optional persistent cache of geocoded addresses ('cache_path'), then from the optional 'geocoder', and finally from the coordinates of the zip code in 'centroids'
+    # (e.g. a Census ZCTA table read with load_centroids). Without 'centroids', the mean coordinates of the offices of df with the same zip code are used instead.
+    if centroids is None:
+        centroids = geo.centroids_from_offices(df)
+    df = geo.backfill_coordinates(df, centroids=centroids, geocoder=geocoder, cache_path=cache_path)
+
+    # This code removes any rows that still have missing values for 'offices_latitude' or 'offices_longitude'.
+    # Resets the index of the dataframe after dropping the specified rows.
     df.dropna(subset=['offices_latitude', 'offices_longitude'], how='all', inplace=True)
     df = df.reset_index(drop=True)
 
@@ -121,44 +159,54 @@ def insert_coordinates (df):
 
 
 
-def function_venue (venue, lat, lon, radius):
+def function_venue (venue, lat, lon, radius, cache=None):
 
     # This function uses the Foursquare Places API to search for venues that match the input parameters
     # and returns the resulting JSON object containing information about the matching venues.
-    url = f"https://api.foursquare.com/v3/places/search?query={venue}&ll={lat}%2C{lon}&radius={radius}"
-    headers = {
-        "accept": "application/json",
-        "Authorization": token
-    }
-    response = requests.get(url, headers=headers).json()
+    # When a VenueCache is given, the stored results are returned instead and new results are stored in it.
+    # The search itself is made by request_venue (see src/fetching.py), which raises FetchError when it fails.
+    if cache is not None:
+        cached = cache.get(venue, lat, lon, radius)
+        if cached is not None:
+            return cached
+    session = fetch.create_session(get_token(), pool_size=1)
+    try:
+        results = fetch.request_venue(session, venue, lat, lon, radius)
+    finally:
+        session.close()
+    if cache is not None:
+        cache.put(venue, lat, lon, radius, results)
+        cache.commit()
+
+    return results
 
-    return response['results']
 
 
+# The Foursquare query of each column of venues, from the category registry of src/scoring.py.
+categories = {column: category["query"] for column, category in score.categories.items()}
 
-def matching_companies (df):
+def matching_companies (df, radius=500, max_workers=8, timeout=10, cache=None, coalesce=False, cell=300, url=fetch.url_search):
 
     # The code creates columns for the resulting list of venues ('vegan_rest', 'preschool', 'starbucks', and 'clubs') within a 500-meter radius of each office location.
+    # All the requests are run concurrently by fetch_venues over 'max_workers' threads sharing one pooled session, and each one gives up after 'timeout' seconds.
+    # An optional VenueCache (see src/cache.py) answers the searches that were already made in a previous run, and 'url' can point to a local stand-in of the API.
+    # With 'coalesce' set to True, offices in the same 'cell' x 'cell' meters square share one wider search, and the report of the saved calls is kept in df.attrs['fetch_report'].
     # Counts the number of venues within each list.
-    df['vegan_rest'] = df.apply(lambda row: function_venue("vegan", row['offices_latitude'], row['offices_longitude'], 500), axis=1)
-    df['num_vegan_rest'] = df['vegan_rest'].apply(lambda row: len(row))
-    df['preschool'] = df.apply(lambda row: function_venue("preschool", row['offices_latitude'], row['offices_longitude'], 500), axis=1)
-    df['num_preschool'] = df['preschool'].apply(lambda row: len(row))
-    df['starbucks'] = df.apply(lambda row: function_venue("starbucks", row['offices_latitude'], row['offices_longitude'], 500), axis=1)
-    df['num_starbucks'] = df['starbucks'].apply(lambda row: len(row))
-    df['clubs'] = df.apply(lambda row: function_venue('night%20clubs', row['offices_latitude'], row['offices_longitude'], 500), axis=1)
-    df['num_clubs'] = df['clubs'].apply(lambda row: len(row))
+    coords = list(zip(df['offices_latitude'], df['offices_longitude']))
+    if coalesce:
+        venues, df.attrs['fetch_report'] = fetch.fetch_venues_coalesced(coords, categories, get_token(), radius=radius, cell=cell, max_workers=max_workers, timeout=timeout, url=url, cache=cache)
+    else:
+        venues = fetch.fetch_venues(coords, categories, get_token(), radius=radius, max_workers=max_workers, timeout=timeout, url=url, cache=cache)
+    for column in categories:
+        df[column] = venues[column]
+        df[f'num_{column}'] = df[column].apply(lambda row: len(row))
 
     return df
 
 
 
-punctuation = {
-    "vegan_rest": 8,
-    "preschool": 5,
-    "starbucks": 7,
-    "club": 5
-}
+# The punctuation of each column of venues, from the category registry of src/scoring.py.
+punctuation = {column: category["punctuation"] for column, category in score.categories.items()}
 
 def weighs_function (punctuation):
     
@@ -181,27 +229,37 @@ def function_weighted_punct (weights, col1, col2, col3, col4):
     weighted_punct = col1 * weights['vegan_rest'] \
                        + col2 * weights['preschool'] \
                        + col3 * weights['starbucks'] \
-                       + col4 * weights['club']
+                       + col4 * weights['clubs']
     
     return weighted_punct
 
 
 
-def final_punctuation (df):
+def final_punctuation (df, weights=None, columns=None, k=None):
 
-    # This code adds a ne:w column to the dataframe containing the weighted sum of four numerical columns ('num_vegan_rest', 'num_preschool', 'num_starbucks', and 'num_clubs') using a function 'function_weighted_punct'. 
-    # Sorts the rows of the dataframe 'df' in descending order based on the values in the weighted column.
-    df['weighted_punct'] = df.apply(lambda row: function_weighted_punct(weights, row['num_vegan_rest'], row['num_preschool'], row['num_starbucks'], row['num_clubs']), axis=1)
-    df = df.sort_values(by='weighted_punct', ascending=False)
+    # This code adds a new column to the dataframe containing the weighted sum of the count columns 'columns' ('num_vegan_rest', 'num_preschool', 'num_starbucks', and 'num_clubs' of the category registry by default).
+    # The weights are the module 'weights' at the time of the call when 'weights' is not given, so reassigning clean.weights changes the ranking.
+    # The weighted sum is computed for all the rows at once as a matrix-vector product (see src/scoring.py).
+    # Sorts the rows of the dataframe 'df' in descending order based on the values in the weighted column, or keeps only the 'k' best rows when 'k' is given.
+    if weights is None:
+        weights = globals()['weights']
+    if columns is None:
+        columns = score.score_columns
+    df['weighted_punct'] = score.score(df, weights, columns)
+    if k is None:
+        df = df.sort_values(by='weighted_punct', ascending=False)
+    else:
+        df = score.select(df, k=k)
 
     return df
 
 
 
-def subset_function (df):
+def subset_function (df, threshold=600, k=None):
 
-    # This code creates a subset of the dataframe where the value in the "weighted_punct" column is greater than 600
-    df_subset = df[df['weighted_punct'] > 600]
+    # This code creates a subset of the dataframe where the value in the "weighted_punct" column is greater than 'threshold' (600 by default),
+    # or, when 'k' is given, with the 'k' rows with the highest "weighted_punct".
+    df_subset = score.select(df, threshold=None if k is not None else threshold, k=k)
 
     return df_subset
 
@@ -222,61 +280,70 @@ def pre_explode(row, name):
 
 
 
-def explode_vegan (df_subset):
+def flatten_venues (df, columns=tuple(categories)):
 
-    # This code creates a subset of the dataframe that contains the expanded and exploded latitude and longitude coordinates of a specific location type (vegan_rest). 
-    df_subset_vegan_rest = df_subset[['name', 'offices_state_code', 'offices_latitude', 'offices_longitude', 'vegan_rest', 'num_vegan_rest']]
-    df_subset_vegan_rest['vegan_rest_coord'] = df_subset_vegan_rest.apply(lambda row: pre_explode(row, 'vegan_rest'), axis=1)
-    df_subset_vegan_rest = df_subset_vegan_rest.explode('vegan_rest_coord')
-    df_subset_vegan_rest = df_subset_vegan_rest.reset_index(drop=True)
-    df_subset_vegan_rest[['latitude', 'longitude']] = df_subset_vegan_rest['vegan_rest_coord'].apply(lambda x: pd.Series([x[0], x[1]]))
-    df_subset_vegan_rest = df_subset_vegan_rest.drop_duplicates(subset='vegan_rest_coord', keep='first')
+    # This function flattens the lists of venues of every category at once into a long-format DataFrame with one row per (office, venue):
+    # office_id (the index of df), category, fsq_id, latitude, longitude and distance (in meters from the office).
+    # The lists are chained once per category and each field is read with one list comprehension, without building a Series per venue.
+    parts = []
+    for column in columns:
+        lists = [x if isinstance(x, list) else [] for x in df[column]]
+        venues = list(chain.from_iterable(lists))
+        parts.append(pd.DataFrame({
+            "office_id": np.repeat(df.index.to_numpy(), [len(x) for x in lists]),
+            "category": column,
+            "fsq_id": [v.get("fsq_id") for v in venues],
+            "latitude": np.array([v["geocodes"]["main"]["latitude"] for v in venues], dtype='float64'),
+            "longitude": np.array([v["geocodes"]["main"]["longitude"] for v in venues], dtype='float64'),
+            "distance": pd.array([v.get("distance") for v in venues], dtype='Int64')
+        }))
+    venues = pd.concat(parts, ignore_index=True)
+    venues['category'] = pd.Categorical(venues['category'], categories=list(columns))
 
-    return df_subset_vegan_rest
+    return venues
 
 
 
-def explode_preschool (df_subset):
+# The name of each column of venues on the map, from the category registry of src/scoring.py.
+category_names = {column: category["name"] for column, category in score.categories.items()}
 
-    # This code creates a subset of the dataframe that contains the expanded and exploded latitude and longitude coordinates of a specific location type (preschool). 
-    df_subset_preschool = df_subset[['name', 'offices_state_code', 'offices_latitude', 'offices_longitude', 'preschool', 'num_preschool']]
-    df_subset_preschool['preschool_coord'] = df_subset_preschool.apply(lambda row: pre_explode(row, 'preschool'), axis=1)
-    df_subset_preschool = df_subset_preschool.explode('preschool_coord')
-    df_subset_preschool = df_subset_preschool.reset_index(drop=True)
-    df_subset_preschool[['latitude', 'longitude']] = df_subset_preschool['preschool_coord'].apply(lambda x: pd.Series([x[0], x[1]]))
-    df_subset_preschool = df_subset_preschool.drop_duplicates(subset='preschool_coord', keep='first')
+def explode_venues (df_subset, columns=tuple(categories)):
 
-    return df_subset_preschool
+    # This code creates one long-format DataFrame with the venues of all the categories near the offices of df_subset, ready for map_plot.
+    # Every venue is kept once per category, using a hash-based drop_duplicates on its fsq_id.
+    # Adds the name, state and coordinates of the office each venue was found for, and the 'category_name' label used by the map.
+    venues = flatten_venues(df_subset, columns)
+    venues = venues.drop_duplicates(subset=['category', 'fsq_id'], keep='first').reset_index(drop=True)
+    offices = df_subset.loc[venues['office_id'].to_numpy(), ['name', 'offices_state_code', 'offices_latitude', 'offices_longitude']].reset_index(drop=True)
+    near_office = pd.concat([offices, venues], axis=1)
+    near_office['category_name'] = near_office['category'].map(category_names).astype(str)
 
+    return near_office
 
 
-def explode_starbucks (df_subset):
- 
-    # This code creates a subset of the dataframe that contains the expanded and exploded latitude and longitude coordinates of a specific location type (starbucks). 
-    df_subset_starbucks = df_subset[['name', 'offices_state_code', 'offices_latitude', 'offices_longitude', 'starbucks', 'num_starbucks']]
-    df_subset_starbucks['starbucks_coord'] = df_subset_starbucks.apply(lambda row: pre_explode(row, 'starbucks'), axis=1)
-    df_subset_starbucks = df_subset_starbucks.explode('starbucks_coord')
-    df_subset_starbucks = df_subset_starbucks.reset_index(drop=True)
-    df_subset_starbucks[['latitude', 'longitude']] = df_subset_starbucks['starbucks_coord'].apply(lambda x: pd.Series([x[0], x[1]]))
-    df_subset_starbucks = df_subset_starbucks.drop_duplicates(subset='starbucks_coord', keep='first')
 
-    return df_subset_starbucks
+def explode_vegan (df_subset):
 
+    # This code creates a subset of the dataframe that contains the exploded latitude and longitude coordinates of a specific location type (vegan_rest). 
+    return explode_venues(df_subset, ['vegan_rest'])
 
 
-def explode_clubs (df_subset):
 
-    # This code creates a subset of the dataframe that contains the expanded and exploded latitude and longitude coordinates of a specific location type (clubs). 
-    df_subset_clubs = df_subset[['name', 'offices_state_code', 'offices_latitude', 'offices_longitude', 'clubs', 'num_clubs']]
-    df_subset_clubs['clubs_coord'] = df_subset_clubs.apply(lambda row: pre_explode(row, 'clubs'), axis=1)
-    df_subset_clubs = df_subset_clubs.explode('clubs_coord')
-    df_subset_clubs = df_subset_clubs.reset_index(drop=True)
-    df_subset_clubs[['latitude', 'longitude']] = df_subset_clubs['clubs_coord'].apply(lambda x: pd.Series([x[0], x[1]]))
-    df_subset_clubs = df_subset_clubs.drop_duplicates(subset='clubs_coord', keep='first')
+def explode_preschool (df_subset):
+
+    # This code creates a subset of the dataframe that contains the exploded latitude and longitude coordinates of a specific location type (preschool). 
+    return explode_venues(df_subset, ['preschool'])
 
-    return df_subset_clubs
 
 
+def explode_starbucks (df_subset):
+ 
+    # This code creates a subset of the dataframe that contains the exploded latitude and longitude coordinates of a specific location type (starbucks). 
+    return explode_venues(df_subset, ['starbucks'])
 
 
 
+def explode_clubs (df_subset):
+
+    # This code creates a subset of the dataframe that contains the exploded latitude and longitude coordinates of a specific location type (clubs). 
+    return explode_venues(df_subset, ['clubs'])
@@ -0,0 +1,154 @@
+import argparse
+import sys
+
+
+
+# This module is the command-line entry point of the pipeline, run without a notebook as: python -m src.cli <stage> [options]
+# Every stage imports the modules it needs when it runs, so starting the command (or a stage that only scores) does not load pymongo, requests, folium or matplotlib.
+#   extract  MongoDB -> flat offices CSV (mongo_aggregate)
+#   fetch    offices CSV -> coordinates and venues, saved as offices and venues tables (see src/storage.py)
+#   convert  CSV saved by the notebooks (data/df_api.csv) -> offices and venues tables
+#   score    offices table -> weighted_punct and the best offices, as a CSV
+#   render   best offices and their venues -> HTML map (folium) or static image (matplotlib)
+
+
+
+def extract (args):
+
+    # This function runs the MongoDB query and the basic cleaning inside MongoDB, and writes the flat office rows to 'args.output'.
+    import src.extraction as extraction
+    c = extraction.mongo_connect(args.host, args.database, args.collection)
+    df = extraction.mongo_aggregate(c, top_states=args.top_states)
+    df.to_csv(args.output, index=False)
+    print(f"{len(df)} offices -> {args.output}")
+
+
+
+def fetch (args):
+
+    # This function fills the missing coordinates of the offices of 'args.input', searches their venues in the Foursquare Places API
+    # (the token is read from the environment or the .env file) and saves the offices and venues tables to 'args.output'.
+    import pandas as pd
+    import src.cleaning as clean
+    import src.storage as storage
+    df = clean.insert_coordinates(pd.read_csv(args.input), cache_path=args.geocode_cache)
+    venue_cache = None
+    if args.cache:
+        import src.cache as cache
+        venue_cache = cache.VenueCache(args.cache)
+    df = clean.matching_companies(df, radius=args.radius, max_workers=args.workers, timeout=args.timeout, cache=venue_cache, coalesce=args.coalesce, url=args.url)
+    if venue_cache is not None:
+        venue_cache.close()
+    offices, venues = storage.normalize_results(df)
+    storage.save_results(offices, venues, args.output, args.format)
+    print(f"{len(offices)} offices, {len(venues)} venues -> {args.output}")
+
+
+
+def convert (args):
+
+    # This function parses a CSV saved by the notebooks once and saves it as offices and venues tables, so it can be scored and rendered.
+    import src.storage as storage
+    offices, venues = storage.convert_csv(args.input, args.output, args.format)
+    print(f"{len(offices)} offices, {len(venues)} venues -> {args.output}")
+
+
+
+def score (args):
+
+    # This function computes the weighted_punct of every office of the offices table and writes the 'args.k' best ones
+    # (or those above 'args.threshold' when 'args.k' is 0) to 'args.output'. Only the offices table is read, and neither requests nor the plotting stack are loaded.
+    import pandas as pd
+    import src.cleaning as clean
+    offices = pd.read_parquet(f"{args.input}/offices.parquet") if args.format == "parquet" else pd.read_feather(f"{args.input}/offices.arrow")
+    offices = clean.final_punctuation(offices)
+    df_subset = clean.subset_function(offices, threshold=args.threshold, k=args.k or None)
+    df_subset.to_csv(args.output, index=False)
+    print(df_subset[['name', 'offices_state_code', 'weighted_punct']].to_string(index=False))
+
+
+
+def render (args):
+
+    # This function draws the offices of 'args.scored' and their venues from the venues table: an HTML map (map_plot) or, when 'args.output' ends in .png, a static image (static_plot).
+    import pandas as pd
+    import src.cleaning as clean
+    import src.visualization as viz
+    df_subset = pd.read_csv(args.scored)
+    venues = pd.read_parquet(f"{args.input}/venues.parquet") if args.format == "parquet" else pd.read_feather(f"{args.input}/venues.arrow")
+    venues = venues[venues['office_id'].isin(df_subset['office_id'])].astype({"category": str, "fsq_id": str})
+    venues = venues.drop_duplicates(subset=['category', 'fsq_id'], keep='first')
+    near_office = venues.merge(df_subset[['office_id', 'name', 'offices_state_code', 'offices_latitude', 'offices_longitude']], on='office_id')
+    near_office['category_name'] = near_office['category'].map(clean.category_names)
+    if args.output.endswith(".png"):
+        viz.static_plot(df_subset, near_office, n_offices=args.n_offices, radius=args.radius, path=args.output)
+    else:
+        viz.map_plot(df_subset, near_office, mode=args.mode, n_offices=args.n_offices, radius=args.radius).save(args.output)
+    print(f"{len(near_office)} venues -> {args.output}")
+
+
+
+def parser ():
+
+    # This function builds the parser of the command line, with one subcommand per stage.
+    main = argparse.ArgumentParser(prog="python -m src.cli", description="Find the best location for the new offices, stage by stage.")
+    stages = main.add_subparsers(dest="stage", required=True)
+
+    stage = stages.add_parser("extract", help="query MongoDB and write the cleaned offices to a CSV")
+    stage.add_argument("--host", default="localhost:27017")
+    stage.add_argument("--database", default="Ironhack")
+    stage.add_argument("--collection", default="companies")
+    stage.add_argument("--top-states", type=int, default=4)
+    stage.add_argument("--output", default="data/offices.csv")
+    stage.set_defaults(run=extract)
+
+    stage = stages.add_parser("fetch", help="search the venues near every office and save the offices and venues tables")
+    stage.add_argument("--input", default="data/offices.csv")
+    stage.add_argument("--output", default="data/pipeline")
+    stage.add_argument("--format", choices=["parquet", "arrow"], default="parquet")
+    stage.add_argument("--radius", type=int, default=500)
+    stage.add_argument("--workers", type=int, default=8)
+    stage.add_argument("--timeout", type=float, default=10)
+    stage.add_argument("--cache", default="data/venue_cache.sqlite", help="SQLite venue cache, '' to disable it")
+    stage.add_argument("--geocode-cache", default="data/geocode_cache.sqlite")
+    stage.add_argument("--coalesce", action="store_true")
+    stage.add_argument("--url", default="https://api.foursquare.com/v3/places/search")
+    stage.set_defaults(run=fetch)
+
+    stage = stages.add_parser("convert", help="convert a CSV saved by the notebooks into offices and venues tables")
+    stage.add_argument("--input", default="data/df_api.csv")
+    stage.add_argument("--output", default="data/pipeline")
+    stage.add_argument("--format", choices=["parquet", "arrow"], default="parquet")
+    stage.set_defaults(run=convert)
+
+    stage = stages.add_parser("score", help="score the offices and write the best ones to a CSV")
+    stage.add_argument("--input", default="data/pipeline")
+    stage.add_argument("--format", choices=["parquet", "arrow"], default="parquet")
+    stage.add_argument("-k", type=int, default=5, help="number of offices to keep, 0 to keep those above --threshold")
+    stage.add_argument("--threshold", type=float, default=600)
+    stage.add_argument("--output", default="data/scored.csv")
+    stage.set_defaults(run=score)
+
+    stage = stages.add_parser("render", help="draw the best offices and their venues")
+    stage.add_argument("--input", default="data/pipeline")
+    stage.add_argument("--format", choices=["parquet", "arrow"], default="parquet")
+    stage.add_argument("--scored", default="data/scored.csv")
+    stage.add_argument("--mode", choices=["markers", "cluster", "geojson"], default="markers")
+    stage.add_argument("--n-offices", type=int, default=5)
+    stage.add_argument("--radius", type=int, default=500)
+    stage.add_argument("--output", default="figures/map.html", help="an .html map, or a .png static image")
+    stage.set_defaults(run=render)
+
+    return main
+
+
+
+def main (argv=None):
+
+    args = parser().parse_args(argv)
+    args.run(args)
+
+
+
+if __name__ == "__main__":
+    sys.exit(main())
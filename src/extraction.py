@@ -1,13 +1,79 @@
-from pymongo import MongoClient
+import numpy as np
+import pandas as pd
 
 
 
-def mongo_connect ():
+def mongo_connect (host="localhost:27017", database="Ironhack", collection="companies"):
     # This function connects to "Ironhack" MongoDB database and returns a collection named "companies".
-    client = MongoClient("localhost:27017")
-    db = client["Ironhack"]
-    c = db.get_collection("companies")
+    # pymongo is imported here, so only the stages that talk to MongoDB load it.
+    from pymongo import MongoClient
+    client = MongoClient(host)
+    db = client[database]
+    c = db.get_collection(collection)
     return c
 
 
 
+def create_indexes (c):
+    # This function creates the recommended indexes for the query of mongo_filter and mongo_aggregate.
+    # Both conditions are unanchored regular expressions, so MongoDB still has to test every key, but it scans the small index keys instead of fetching every full document.
+    from pymongo import ASCENDING
+    c.create_index([("total_money_raised", ASCENDING)], name="total_money_raised")
+    c.create_index([("tag_list", ASCENDING)], name="tag_list")
+
+
+
+office_fields = {
+    "offices_country_code": "country_code",
+    "offices_state_code": "state_code",
+    "offices_latitude": "latitude",
+    "offices_longitude": "longitude",
+    "offices_address_1": "address1",
+    "offices_address_2": "address2",
+    "offices_zip_code": "zip_code"
+}
+
+def base_pipeline ():
+    # This function returns the first stages shared by every aggregation: the same query and projection as mongo_filter, followed by an $unwind of the offices.
+    condition_1 = {"total_money_raised": {"$regex": "M$"}}
+    condition_2 = {"tag_list": {"$regex": "design"}}
+    return [
+        {"$match": {"$and": [condition_1, condition_2]}},
+        {"$project": {"name": 1, "total_money_raised": 1, "offices": 1, "_id": 0}},
+        {"$unwind": "$offices"}
+    ]
+
+
+
+def top_values (c, field, k, match=None):
+    # This function ranks the values of an office field by frequency inside MongoDB and returns the 'k' most frequent ones, as value_counts does in basic_cleaning_1/2.
+    # Ties are broken by value, so the result does not depend on the order of the documents.
+    pipeline = base_pipeline()
+    if match:
+        pipeline.append({"$match": match})
+    pipeline += [
+        {"$group": {"_id": f"$offices.{field}", "count": {"$sum": 1}}},
+        {"$match": {"_id": {"$nin": [None, ""]}}},
+        {"$sort": {"count": -1, "_id": 1}},
+        {"$limit": k}
+    ]
+    return [doc["_id"] for doc in c.aggregate(pipeline)]
+
+
+
+def mongo_aggregate (c, top_states=4):
+    # This function does the work of mongo_filter, basic_cleaning_1, basic_cleaning_2 and basic_cleaning_3 inside MongoDB.
+    # Two small aggregations rank the most frequent country and the 'top_states' most frequent states of that country.
+    # The final aggregation unwinds the offices, keeps those of the top country and states, flattens the office fields, turns empty strings into nulls
+    # and drops the offices without latitude, longitude and both addresses, so only the final flat office rows come back over the wire.
+    country = top_values(c, "country_code", 1)
+    states = top_values(c, "state_code", top_states, {"offices.country_code": {"$in": country}})
+    pipeline = base_pipeline() + [
+        {"$match": {"offices.country_code": {"$in": country}, "offices.state_code": {"$in": states}}},
+        {"$project": {"name": 1, "total_money_raised": 1, **{column: {"$cond": [{"$eq": [f"$offices.{field}", ""]}, None, f"$offices.{field}"]} for column, field in office_fields.items()}}},
+        {"$match": {"$or": [{column: {"$ne": None}} for column in ["offices_latitude", "offices_longitude", "offices_address_1", "offices_address_2"]]}}
+    ]
+    df = pd.DataFrame(list(c.aggregate(pipeline)), columns=["name", "total_money_raised", *office_fields])
+    df = df.fillna(np.nan)
+
+    return df
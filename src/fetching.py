@@ -0,0 +1,179 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+
+
+
+url_search = "https://api.foursquare.com/v3/places/search"
+
+
+
+class FetchError (RuntimeError):
+
+    # This exception is raised when a venue search still fails after its retries, with the query and the coordinates of the search in its message.
+    pass
+
+
+
+def create_session (token, pool_size=8, retries=3):
+
+    # This function creates a single requests Session that is shared by every call to the Foursquare Places API.
+    # Mounts an HTTPAdapter whose connection pool is as big as the number of workers, so the TCP/TLS connections are reused instead of opened once per request.
+    # The adapter retries a search up to 'retries' times when the API answers 429 (rate limited, honouring its Retry-After header) or a 5xx error, with an exponential backoff.
+    # requests is imported here, so importing this module does not load it before the first fetch.
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    session = requests.Session()
+    retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504), allowed_methods=("GET",), raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({
+        "accept": "application/json",
+        "Authorization": token
+    })
+
+    return session
+
+
+
+def request_venue (session, venue, lat, lon, radius, timeout=10, url=url_search, limit=None):
+
+    # This function searches for venues that match the input parameters using the given session,
+    # and returns the list of matching venues of the resulting JSON object.
+    # 'limit' sets the maximum number of venues returned by the API (10 when it is not given).
+    # An error status (e.g. 401 for a wrong token, or 429 once the retries are exhausted), a timeout or an answer without results raises FetchError.
+    import requests
+    search = f"{url}?query={venue}&ll={lat}%2C{lon}&radius={radius}"
+    if limit is not None:
+        search += f"&limit={limit}"
+    try:
+        response = session.get(search, timeout=timeout)
+        response.raise_for_status()
+        return response.json()['results']
+    except (requests.RequestException, KeyError, ValueError) as error:
+        raise FetchError(f"venue search failed for query={venue!r} at ({lat}, {lon}) with radius {radius}: {error!r}") from error
+
+
+
+def fetch_venues (coords, queries, token, radius=500, max_workers=8, timeout=10, url=url_search, cache=None, limit=None):
+
+    # This function runs one request per (category, office) pair over a bounded pool of worker threads that share one pooled session.
+    # 'coords' is a list of (latitude, longitude) tuples and 'queries' a dictionary that maps each output column to its Foursquare query.
+    # 'radius' is either one radius for every office or a list of radii aligned with 'coords'.
+    # When a VenueCache is given, the stored searches are answered from it first and only the misses go to the API.
+    # The cache is committed after these lookups, so the access times they refresh are kept for the LRU eviction even when nothing is fetched.
+    # Each result is stored in the cache as soon as its search completes, and the cache is committed even when some searches fail,
+    # so a failed run keeps every result it got and the next run only repeats the failed searches. The first error is raised once all the searches are done.
+    # Each result is put back at the position of its job, so they are split into one list per column aligned with 'coords'.
+    radii = list(radius) if np.ndim(radius) else [radius] * len(coords)
+    jobs = [(column, query, lat, lon, r) for column, query in queries.items() for (lat, lon), r in zip(coords, radii)]
+    keys = [query if limit is None else f"{query}&limit={limit}" for column, query, lat, lon, r in jobs]
+    results = [None] * len(jobs)
+    if cache is not None:
+        results = [cache.get(key, lat, lon, r) for key, (column, query, lat, lon, r) in zip(keys, jobs)]
+        cache.commit()
+    missing = [i for i, result in enumerate(results) if result is None]
+
+    if missing:
+        error = None
+        session = create_session(token, pool_size=max_workers)
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {executor.submit(request_venue, session, *jobs[i][1:], timeout=timeout, url=url, limit=limit): i for i in missing}
+                for future in as_completed(futures):
+                    i = futures[future]
+                    try:
+                        results[i] = future.result()
+                    except Exception as e:
+                        error = error or e
+                        continue
+                    if cache is not None:
+                        cache.put(keys[i], jobs[i][2], jobs[i][3], jobs[i][4], results[i])
+        finally:
+            session.close()
+            if cache is not None:
+                cache.commit()
+        if error is not None:
+            raise error
+
+    n = len(coords)
+    venues = {column: results[i * n:(i + 1) * n] for i, column in enumerate(queries)}
+
+    return venues
+
+
+
+def haversine (lat1, lon1, lat2, lon2):
+
+    # This function returns the great-circle distance in meters between two points, or between two broadcastable arrays of points.
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(x, dtype=float)) for x in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+
+    return 2 * 6371008.8 * np.arcsin(np.sqrt(a))
+
+
+
+def plan_clusters (coords, cell=300):
+
+    # This function groups the office coordinates into clusters by snapping them to a grid of 'cell' x 'cell' meters, so exact duplicates and neighbouring offices share one cluster.
+    # Returns the cluster label of each office, the centre (mean coordinates) of each cluster and the distance from each office to its cluster centre.
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    lat, lon = coords[:, 0], coords[:, 1]
+    rows = np.floor(lat * 111320 / cell)
+    cols = np.floor(lon * 111320 * np.cos(np.radians((rows + 0.5) * cell / 111320)) / cell)
+    cells, labels = np.unique(np.column_stack([rows, cols]), axis=0, return_inverse=True)
+    labels = labels.ravel()
+    counts = np.bincount(labels)
+    centres = np.column_stack([np.bincount(labels, lat) / counts, np.bincount(labels, lon) / counts])
+    offsets = haversine(lat, lon, centres[labels, 0], centres[labels, 1])
+
+    return labels, centres, offsets
+
+
+
+def fetch_venues_coalesced (coords, queries, token, radius=500, cell=300, limit=50, max_workers=8, timeout=10, url=url_search, cache=None):
+
+    # This function issues one wider search per cluster of offices (see plan_clusters) instead of one search per office.
+    # The radius of each cluster search is 'radius' plus the distance to its farthest office, so it covers the circle of every office in the cluster.
+    # Each venue is then assigned back to every office of the cluster that is at most 'radius' meters away (haversine), with its 'distance' recomputed from that office.
+    # When a cluster search returns 'limit' venues it may have been truncated, so the offices of that cluster fall back to their own 'radius' search.
+    # A single office only gets up to 10 venues, the same as the default limit of its own search, so the per-office counts match the uncoalesced ones.
+    # Returns the venues per column aligned with 'coords', and a report of how many API calls were saved.
+    labels, centres, offsets = plan_clusters(coords, cell)
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    farthest = np.zeros(len(centres))
+    np.maximum.at(farthest, labels, offsets)
+    cluster_radius = np.ceil(radius + farthest).astype(int)
+    clusters = fetch_venues([tuple(c) for c in centres], queries, token, radius=cluster_radius, max_workers=max_workers, timeout=timeout, url=url, cache=cache, limit=limit)
+
+    venues = {column: [None] * len(coords) for column in queries}
+    fallback = {column: [] for column in queries}
+    for column in queries:
+        for i, (lat, lon) in enumerate(coords):
+            found = clusters[column][labels[i]]
+            if len(found) >= limit:
+                fallback[column].append(i)
+                continue
+            if not found:
+                venues[column][i] = []
+                continue
+            venue_lat = np.array([v["geocodes"]["main"]["latitude"] for v in found])
+            venue_lon = np.array([v["geocodes"]["main"]["longitude"] for v in found])
+            distance = haversine(lat, lon, venue_lat, venue_lon)
+            near = np.argsort(distance, kind="stable")
+            near = near[distance[near] <= radius][:10]
+            venues[column][i] = [{**found[j], "distance": int(round(distance[j]))} for j in near]
+
+    for column, rows in fallback.items():
+        if rows:
+            refetched = fetch_venues([tuple(coords[i]) for i in rows], {column: queries[column]}, token, radius=radius, max_workers=max_workers, timeout=timeout, url=url, cache=cache)
+            for i, result in zip(rows, refetched[column]):
+                venues[column][i] = result
+
+    calls_naive = len(coords) * len(queries)
+    calls = len(centres) * len(queries) + sum(len(rows) for rows in fallback.values())
+    report = {"offices": len(coords), "clusters": len(centres), "calls_naive": calls_naive, "calls": calls,
+              "calls_saved": calls_naive - calls, "fallbacks": sum(len(rows) for rows in fallback.values())}
+
+    return venues, report
@@ -0,0 +1,145 @@
+import os
+import sqlite3
+from contextlib import closing
+import numpy as np
+import pandas as pd
+
+
+
+def zip5 (zip_codes):
+
+    # This function normalizes zip codes to their first five digits ("10016-5602" -> "10016"), leaving a missing value when there are none.
+    return pd.Series(zip_codes, dtype=object).astype(str).str.extract(r'(\d{5})', expand=False)
+
+
+
+def address_keys (df):
+
+    # This function builds one normalized key per office from offices_address_1, offices_address_2 and offices_zip_code
+    # (lower case, single spaces, without punctuation), so the same address written twice is geocoded once.
+    parts = [df[column].fillna('').astype(str) for column in ['offices_address_1', 'offices_address_2']]
+    keys = (parts[0] + ' ' + parts[1] + ' ' + zip5(df['offices_zip_code']).fillna('').to_numpy())
+    keys = keys.str.lower().str.replace(r'[^\w\s]', ' ', regex=True).str.split().str.join(' ')
+
+    return keys
+
+
+
+def load_centroids (path):
+
+    # This function reads a table of postal-code centroids into a DataFrame indexed by the 5-digit zip code, with latitude and longitude columns.
+    # It reads the US Census ZCTA Gazetteer files (GEOID, INTPTLAT, INTPTLONG, tab separated, e.g. 2020_Gaz_zcta_national.txt), which cover every US zip code,
+    # and any CSV table with zip_code, latitude and longitude columns.
+    sep = '\t' if path.endswith('.txt') else ','
+    centroids = pd.read_csv(path, sep=sep, dtype=str)
+    centroids.columns = centroids.columns.str.strip()
+    centroids = centroids.rename(columns={"GEOID": "zip_code", "INTPTLAT": "latitude", "INTPTLONG": "longitude"})
+    centroids['zip_code'] = zip5(centroids['zip_code']).to_numpy()
+    centroids[['latitude', 'longitude']] = centroids[['latitude', 'longitude']].astype('float64')
+
+    return centroids.dropna(subset=['zip_code']).drop_duplicates('zip_code').set_index('zip_code')[['latitude', 'longitude']]
+
+
+
+def zip_sums (df, by=[]):
+
+    # This function sums the latitudes and longitudes of the offices that already have coordinates, and counts them, per zip code (and per the 'by' columns).
+    # The sums of several chunks of offices can be added together (DataFrame.add with fill_value=0), so the table is built in one pass and in constant memory.
+    known = df.dropna(subset=['offices_latitude', 'offices_longitude'])
+    known = known[by + ['offices_latitude', 'offices_longitude']].assign(zip_code=zip5(known['offices_zip_code']).to_numpy())
+    grouped = known.groupby(by + ['zip_code'])
+    sums = grouped[['offices_latitude', 'offices_longitude']].sum()
+    sums['offices'] = grouped.size()
+
+    return sums
+
+
+
+def centroids_from_sums (sums):
+
+    # This function divides the sums of zip_sums by the number of offices, giving the mean latitude and longitude per zip code.
+    centroids = sums[['offices_latitude', 'offices_longitude']].div(sums['offices'], axis=0)
+    centroids.columns = ['latitude', 'longitude']
+
+    return centroids
+
+
+
+def centroids_from_offices (df):
+
+    # This function builds a stand-in for zip-code centroids from the offices that already have coordinates: the mean of their latitudes and longitudes per zip code.
+    # It is not a postal centroid table: it only covers the zip codes of those offices, and places an office at its neighbours of the same zip code.
+    # The mean replaces the median used before, because it can be accumulated chunk by chunk (see top_codes in src/streaming.py).
+    return centroids_from_sums(zip_sums(df))
+
+
+
+def connect (path):
+
+    # This code opens the SQLite cache at 'path', creating its directory and its table first if they do not exist yet.
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    con = sqlite3.connect(path)
+    con.execute("CREATE TABLE IF NOT EXISTS geocodes (key TEXT PRIMARY KEY, latitude REAL, longitude REAL)")
+
+    return con
+
+
+
+def read_cache (path):
+
+    # This code reads every geocoded address stored in the SQLite cache into a DataFrame indexed by address key.
+    # The connection is closed when done ("with con" only commits or rolls back the transaction).
+    with closing(connect(path)) as con, con:
+        return pd.read_sql("SELECT key, latitude, longitude FROM geocodes", con, index_col='key')
+
+
+
+def write_cache (path, resolved):
+
+    # This code stores the newly geocoded addresses in the SQLite cache in a single transaction, and closes the connection.
+    with closing(connect(path)) as con, con:
+        con.executemany("INSERT OR REPLACE INTO geocodes VALUES (?, ?, ?)", resolved[['latitude', 'longitude']].itertuples(name=None))
+
+
+
+def backfill_coordinates (df, centroids=None, geocoder=None, cache_path=None):
+
+    # This function fills the missing offices_latitude/offices_longitude of df in batch, instead of from hand-entered lists:
+    # 1. The addresses of the offices without coordinates are normalized into keys and deduplicated, so each distinct address is looked up once.
+    # 2. The keys already stored in the optional persistent cache ('cache_path', e.g. "data/geocode_cache.sqlite") are answered from it.
+    # 3. The rest go, in one call, to the optional 'geocoder': a function that takes a DataFrame of unique addresses (offices_address_1, offices_address_2,
+    #    offices_zip_code, indexed by key) and returns a DataFrame of latitude and longitude with the same index (any local or stub geocoder can be plugged in).
+    # 4. What is still missing falls back to the coordinates of its zip code in the optional 'centroids' table (see load_centroids and centroids_from_offices).
+    # Nothing else is guessed: without 'centroids' or 'geocoder', only the cached addresses are filled.
+    # The results of the geocoder are stored in the cache, and all the results are joined back to every office with the same key.
+    df = df.copy()
+    missing = df['offices_latitude'].isna() | df['offices_longitude'].isna()
+    if not missing.any():
+        return df
+    keys = address_keys(df[missing])
+    addresses = df.loc[missing, ['offices_address_1', 'offices_address_2', 'offices_zip_code']].set_index(keys.to_numpy())
+    addresses = addresses[~addresses.index.duplicated()]
+    resolved = pd.DataFrame({"latitude": np.nan, "longitude": np.nan}, index=addresses.index)
+
+    if cache_path is not None:
+        resolved.update(read_cache(cache_path))
+
+    todo = resolved['latitude'].isna()
+    if geocoder is not None and todo.any():
+        geocoded = geocoder(addresses[todo.to_numpy()]).dropna(subset=['latitude', 'longitude'])
+        resolved.update(geocoded)
+        if cache_path is not None and not geocoded.empty:
+            write_cache(cache_path, geocoded)
+
+    todo = resolved['latitude'].isna()
+    if centroids is not None and todo.any():
+        centroids = centroids[~centroids.index.duplicated()]
+        by_zip = centroids.reindex(zip5(addresses.loc[todo.to_numpy(), 'offices_zip_code']).to_numpy())
+        by_zip.index = todo[todo].index
+        resolved.update(by_zip)
+
+    found = resolved.reindex(keys.to_numpy())
+    df.loc[missing, 'offices_latitude'] = df.loc[missing, 'offices_latitude'].fillna(pd.Series(found['latitude'].to_numpy(), index=keys.index))
+    df.loc[missing, 'offices_longitude'] = df.loc[missing, 'offices_longitude'].fillna(pd.Series(found['longitude'].to_numpy(), index=keys.index))
+
+    return df
@@ -0,0 +1,64 @@
+import os
+import pandas as pd
+import src.cleaning as clean
+
+
+
+def office_keys (df):
+
+    # This function gives every office row a stable identity: a hash of the company name and the office address, plus its occurrence number
+    # so that identical office rows of the same company still get different keys.
+    identity = df[['name', 'offices_address_1', 'offices_address_2', 'offices_zip_code']].astype(str)
+    keys = pd.util.hash_pandas_object(identity, index=False).astype('int64')
+    occurrence = keys.groupby(keys.to_numpy()).cumcount()
+
+    return keys.astype(str) + '_' + occurrence.astype(str)
+
+
+
+def office_fingerprints (df, radius=500, precision=5):
+
+    # This function hashes what the venues of an office depend on: its coordinates rounded to 'precision' decimals, the search radius and the categories.
+    # An office whose fingerprint changed since the last run has moved (or the search changed), so its venues must be fetched again.
+    location = pd.DataFrame({"lat": df['offices_latitude'].round(precision).to_numpy(), "lon": df['offices_longitude'].round(precision).to_numpy()})
+    location['search'] = f"{radius}|{'|'.join(clean.categories.values())}"
+
+    return pd.util.hash_pandas_object(location, index=False).to_numpy(dtype='uint64')
+
+
+
+def incremental_matching (df, state_path="data/incremental_state.pkl", radius=500, **venue_kwargs):
+
+    # This function does the work of matching_companies and final_punctuation, but only fetches the venues of the offices that are new or have moved since the previous run.
+    # The previous run is kept in 'state_path': the key and fingerprint of every office with its lists of venues, venue counts and weighted_punct.
+    # The unchanged offices reuse their stored venues, the offices that are no longer in df are dropped, and the ranking is recomputed from the merged state.
+    # The numbers of new, moved, unchanged and removed offices are kept in df.attrs['incremental_report'].
+    df = df.reset_index(drop=True)
+    df['office_key'] = office_keys(df).to_numpy()
+    df['office_fingerprint'] = office_fingerprints(df, radius)
+    venue_columns = [column for category in clean.categories for column in (category, f'num_{category}')]
+
+    if os.path.exists(state_path):
+        previous = pd.read_pickle(state_path).set_index('office_key')
+    else:
+        previous = pd.DataFrame(columns=['office_fingerprint', *venue_columns]).rename_axis('office_key')
+    known = df['office_key'].isin(previous.index).to_numpy()
+    stored_fingerprint = previous['office_fingerprint'].reindex(df['office_key']).to_numpy()
+    unchanged = known & (stored_fingerprint == df['office_fingerprint'].to_numpy())
+
+    reused = df[unchanged].copy()
+    reused[venue_columns] = previous.loc[reused['office_key'], venue_columns].to_numpy()
+    fetched = df[~unchanged].copy()
+    if not fetched.empty:
+        fetched = clean.matching_companies(fetched, radius=radius, **venue_kwargs)
+    merged = pd.concat([reused, fetched]).sort_index()
+    for category in clean.categories:
+        merged[f'num_{category}'] = merged[f'num_{category}'].astype('int64')
+    merged = clean.final_punctuation(merged)
+
+    os.makedirs(os.path.dirname(state_path) or '.', exist_ok=True)
+    merged[['office_key', 'office_fingerprint', *venue_columns, 'weighted_punct']].to_pickle(state_path)
+    merged.attrs['incremental_report'] = {"new": int((~known).sum()), "moved": int((known & ~unchanged).sum()), "unchanged": int(unchanged.sum()),
+                                          "removed": int((~previous.index.isin(df['office_key'])).sum())}
+
+    return merged
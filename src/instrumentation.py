@@ -0,0 +1,175 @@
+import functools
+import importlib
+import inspect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+
+
+
+# The pipeline modules whose functions are timed, and the functions that are counted as calls to the Foursquare API.
+# Every HTTP request to the API goes through request_venue (function_venue too), so the searches answered by a cache are not counted.
+modules = ["src.extraction", "src.cleaning", "src.visualization", "src.fetching", "src.geocoding", "src.scoring", "src.streaming"]
+api_functions = {"src.fetching.request_venue"}
+
+events = []
+originals = {}
+lock = threading.Lock()
+cache_counts = {"hits": 0, "misses": 0}
+t0 = time.perf_counter()
+
+
+
+def rss ():
+
+    # This function returns the resident memory of the process in bytes, read from /proc on Linux, or None where it is not available.
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+
+def rows (value):
+
+    # This function returns the number of rows of a DataFrame (or of any sized result), or None.
+    if isinstance(value, (pd.DataFrame, pd.Series, list)):
+        return len(value)
+    return None
+
+
+
+def wrap (name, function):
+
+    # This function returns a wrapper of 'function' that records one event per call: start, wall time, rows in and out, and memory delta.
+    @functools.wraps(function)
+    def wrapper (*args, **kwargs):
+        memory = rss()
+        return_value = None
+        start = time.perf_counter()
+        try:
+            return_value = function(*args, **kwargs)
+            return return_value
+        finally:
+            seconds = time.perf_counter() - start
+            end_memory = rss()
+            event = {"name": name, "start": start - t0, "seconds": seconds, "thread": threading.get_ident(),
+                     "rows_in": rows(args[0]) if args else None,
+                     "rows_out": rows(return_value),
+                     "memory_delta": end_memory - memory if memory is not None and end_memory is not None else None,
+                     "api_call": name in api_functions}
+            with lock:
+                events.append(event)
+
+    return wrapper
+
+
+
+def enable ():
+
+    # This function turns the instrumentation on by replacing every function defined in the pipeline modules with a timed wrapper, and counts the cache hits and misses.
+    # The functions are replaced in their modules, so the calls between them (e.g. matching_companies -> fetch_venues -> request_venue) are recorded too.
+    # Nothing is wrapped while it is off, so the disabled instrumentation has no overhead at all. Generator functions are left as they are.
+    if originals:
+        return
+    for module_name in modules:
+        module = importlib.import_module(module_name)
+        for name, function in inspect.getmembers(module, inspect.isfunction):
+            if function.__module__ == module_name and not inspect.isgeneratorfunction(function):
+                originals[(module, name)] = function
+                setattr(module, name, wrap(f"{module_name}.{name}", function))
+
+    cache = importlib.import_module("src.cache")
+    get = cache.VenueCache.get
+    originals[(cache.VenueCache, "get")] = get
+
+    def counted_get (self, *args, **kwargs):
+        try:
+            result = get(self, *args, **kwargs)
+        except cache.CacheMiss:
+            cache_counts["misses"] += 1
+            raise
+        cache_counts["hits" if result is not None else "misses"] += 1
+        return result
+
+    cache.VenueCache.get = counted_get
+
+
+
+def disable ():
+
+    # This function puts back the original functions.
+    for (owner, name), function in originals.items():
+        setattr(owner, name, function)
+    originals.clear()
+
+
+
+def reset ():
+
+    # This function clears the recorded events and counters.
+    with lock:
+        events.clear()
+    cache_counts.update({"hits": 0, "misses": 0})
+
+
+
+def summary ():
+
+    # This function summarizes the recorded events: one row per function with its number of calls, total and mean wall time, rows in/out of the last call and total memory delta,
+    # plus the number of API calls with their latency percentiles (p50, p90, p99, in seconds) and the cache hit rate.
+    df = pd.DataFrame(events)
+    if df.empty:
+        return {"functions": df, "api": {"calls": 0}, "cache": dict(cache_counts)}
+    functions = df.groupby("name").agg(calls=("seconds", "size"), seconds=("seconds", "sum"), mean_seconds=("seconds", "mean"),
+                                       rows_in=("rows_in", "last"), rows_out=("rows_out", "last"), memory_delta=("memory_delta", "sum"))
+    latency = df.loc[df["api_call"], "seconds"].to_numpy()
+    api = {"calls": len(latency)}
+    if len(latency):
+        api.update(zip(["p50", "p90", "p99"], np.percentile(latency, [50, 90, 99]).tolist()))
+    total = cache_counts["hits"] + cache_counts["misses"]
+
+    return {"functions": functions.sort_values("seconds", ascending=False), "api": api,
+            "cache": {**cache_counts, "hit_rate": cache_counts["hits"] / total if total else None}}
+
+
+
+def write_trace (path, format="jsonl"):
+
+    # This function writes the recorded events to 'path', either as JSON lines (one event per line, "jsonl")
+    # or in the Chrome trace format ("chrome"), which can be opened in chrome://tracing or Perfetto.
+    with lock:
+        recorded = list(events)
+    with open(path, "w") as f:
+        if format == "jsonl":
+            for event in recorded:
+                f.write(json.dumps(event) + "\n")
+        elif format == "chrome":
+            trace = [{"name": event["name"], "cat": "api" if event["api_call"] else "pipeline", "ph": "X", "pid": os.getpid(), "tid": event["thread"],
+                      "ts": event["start"] * 1e6, "dur": event["seconds"] * 1e6,
+                      "args": {key: event[key] for key in ["rows_in", "rows_out", "memory_delta"]}} for event in recorded]
+            json.dump({"traceEvents": trace, "otherData": {"cache": dict(cache_counts)}}, f)
+        else:
+            raise ValueError(f"unknown format: {format}")
+
+
+
+@contextmanager
+def trace (path=None, format="jsonl"):
+
+    # This context manager instruments the pipeline for the duration of the block, and writes the trace to 'path' at the end when it is given.
+    # For example: with trace("trace.json", "chrome"): df = clean.matching_companies(df)
+    reset()
+    enable()
+    try:
+        yield
+    finally:
+        disable()
+        if path is not None:
+            write_trace(path, format)
+
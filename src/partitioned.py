@@ -0,0 +1,68 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import src.cleaning as clean
+import src.scoring as score
+
+
+
+def shard_keys (df, by="state", cell=1.0):
+
+    # This function gives every office the key of its shard: its state code (by="state"), or the cell of a 'cell' x 'cell' degrees grid
+    # that contains it (by="grid"), which works like a geohash prefix for offices without a state. Offices without a key go to the shard "".
+    if by == "state":
+        return df['offices_state_code'].astype(object).fillna('').astype(str).to_numpy()
+    if by == "grid":
+        lat, lon = df['offices_latitude'].to_numpy(dtype='float64'), df['offices_longitude'].to_numpy(dtype='float64')
+        keys = pd.Series(np.floor(lat / cell)).astype('Int64').astype(str) + ':' + pd.Series(np.floor(lon / cell)).astype('Int64').astype(str)
+        return keys.where(~np.isnan(lat) & ~np.isnan(lon), '').to_numpy()
+    raise ValueError(f"unknown partitioning: {by}")
+
+
+
+def process_shard (shard, df, k, venue_kwargs):
+
+    # This function runs the rest of the pipeline on one shard, inside a worker process: matching_companies, final_punctuation,
+    # and explode_venues of the 'k' best offices of the shard (the global top k is always among the top k of the shards).
+    df = clean.matching_companies(df, **venue_kwargs)
+    df = clean.final_punctuation(df)
+    df_subset = score.select(df, k=k)
+    near_office = clean.explode_venues(df_subset)
+    near_office['office_uid'] = df_subset.loc[near_office['office_id'], 'office_uid'].to_numpy()
+
+    return shard, df, near_office
+
+
+
+def run_partitioned (df, k=5, by="state", cell=1.0, workers=None, cache_path=None, **venue_kwargs):
+
+    # This function runs the pipeline on the offices of df (the output of basic_cleaning_1, so every state is kept and not only the top four of basic_cleaning_2)
+    # split into shards (see shard_keys), one shard per task of a pool of 'workers' processes (all the cores by default).
+    # basic_cleaning_3 and insert_coordinates run once on all the offices before they are split, so the missing coordinates are filled from the whole table
+    # (with the geocode cache 'cache_path', None to disable it) and the offices end up in the same shards and with the same coordinates whatever the partitioning.
+    # The results of the shards are merged and the 'k' offices with the highest weighted_punct are selected globally.
+    # Returns all the scored offices, the 'k' best ones, and the exploded venues of those 'k' offices, ready for map_plot.
+    df = clean.basic_cleaning_3(clean.add_office_columns(df))
+    df = clean.insert_coordinates(df, cache_path=cache_path)
+    df['office_uid'] = np.arange(len(df))
+    keys = shard_keys(df, by, cell)
+    shards = [(shard, df[keys == shard]) for shard in pd.unique(keys)]
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        results = list(executor.map(process_shard, [s for s, _ in shards], [x for _, x in shards], [k] * len(shards), [venue_kwargs] * len(shards)))
+
+    scored = [result for _, result, _ in results if not result.empty]
+    near_office = [near for _, _, near in results if not near.empty]
+    scored = pd.concat(scored, ignore_index=True) if scored else df.assign(weighted_punct=np.nan).iloc[:0]
+    if near_office:
+        near_office = pd.concat(near_office, ignore_index=True)
+    else:
+        # No shard found any venue: an empty frame with the columns of explode_venues, so map_plot and static_plot can still draw the offices.
+        near_office = clean.explode_venues(df.iloc[:0].reindex(columns=[*df.columns, *clean.categories])).assign(office_uid=pd.Series(dtype='int64'))
+    scored = scored.sort_values('weighted_punct', ascending=False, kind='stable').reset_index(drop=True)
+    df_subset = score.select(scored, k=k)
+    near_office = near_office[near_office['office_uid'].isin(df_subset['office_uid'])]
+    near_office = near_office.drop_duplicates(subset=['category', 'fsq_id'], keep='first').reset_index(drop=True)
+
+    return scored, df_subset, near_office
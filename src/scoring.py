@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+
+
+
+# The category registry: one entry per column of venues (the columns added by matching_companies), with its Foursquare query,
+# its count column, its punctuation (the weights are the punctuations as percentages of their total, see weighs_function in src/cleaning.py) and its name on the map.
+# Adding a category only takes a new entry here.
+categories = {
+    "vegan_rest": {"query": "vegan", "count": "num_vegan_rest", "punctuation": 8, "name": "Vegan"},
+    "preschool": {"query": "preschool", "count": "num_preschool", "punctuation": 5, "name": "Preschools"},
+    "starbucks": {"query": "starbucks", "count": "num_starbucks", "punctuation": 7, "name": "Starbucks"},
+    "clubs": {"query": "night%20clubs", "count": "num_clubs", "punctuation": 5, "name": "Clubs"}
+}
+
+score_columns = {column: category["count"] for column, category in categories.items()}
+
+
+
+def weight_matrix (weights, columns=score_columns):
+
+    # This function turns the weights into a matrix with one row per category of 'columns' (which maps each column of venues of the registry to its count column).
+    # 'weights' is either one dictionary of weights per category, which gives a single column, or a list of such dictionaries, which gives one column per weight vector.
+    weight_sets = [weights] if isinstance(weights, dict) else list(weights)
+    matrix = np.array([[w[category] for w in weight_sets] for category in columns], dtype='float64')
+
+    return matrix
+
+
+
+def score (df, weights, columns=score_columns):
+
+    # This function computes the weighted punctuation of every row as one matrix product of the count columns and the weights.
+    # Returns a 1-D array for one dictionary of weights, and a 2-D array with one column per weight vector for a list of them.
+    counts = df[list(columns.values())].to_numpy(dtype='float64')
+    scores = counts @ weight_matrix(weights, columns)
+
+    return scores[:, 0] if isinstance(weights, dict) else scores
+
+
+
+def what_if (df, weight_sets, columns=score_columns):
+
+    # This function scores the rows with many alternative weight vectors in one batched call.
+    # 'weight_sets' maps a name to a dictionary of weights, and the result has one column of scores per name, with the same index as df.
+    scores = score(df, list(weight_sets.values()), columns)
+
+    return pd.DataFrame(scores, index=df.index, columns=list(weight_sets))
+
+
+
+def top_k (scores, k):
+
+    # This function returns the positions of the 'k' highest scores in descending order.
+    # np.argpartition finds them in linear time, so only those 'k' positions are sorted instead of the whole array.
+    scores = np.asarray(scores)
+    if k >= len(scores):
+        return np.argsort(-scores, kind='stable')
+    best = np.argpartition(-scores, k - 1)[:k]
+    best = np.sort(best)
+
+    return best[np.argsort(-scores[best], kind='stable')]
+
+
+
+def select (df, column='weighted_punct', threshold=None, k=None):
+
+    # This function keeps the rows whose score in 'column' is greater than 'threshold', and/or the 'k' rows with the highest scores, sorted in descending order.
+    if threshold is not None:
+        df = df[df[column] > threshold]
+    if k is not None:
+        df = df.iloc[top_k(df[column].to_numpy(), k)]
+
+    return df
@@ -0,0 +1,128 @@
+import numpy as np
+import pandas as pd
+
+
+
+earth_radius = 6371008.8
+
+
+
+def unit_vectors (lat, lon):
+
+    # This function converts latitudes and longitudes in degrees into points on the unit sphere, one row (x, y, z) per point.
+    lat, lon = np.radians(np.asarray(lat, dtype='float64')), np.radians(np.asarray(lon, dtype='float64'))
+
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+
+class VenueIndex:
+
+    # This class is a grid index over the venue coordinates, so the venues near many offices can be counted locally for any radius without calling the API again.
+    # The venues are placed on the unit sphere and bucketed into cubes whose side is the chord of 'max_radius' meters. A venue within 'max_radius' of an office
+    # is then always in one of the 27 cubes around the office, and the great-circle distance is computed only for the venues in those cubes.
+
+    def __init__ (self, lat, lon, max_radius=1000):
+        self.max_radius = max_radius
+        self.cell = 2 * np.sin(max_radius / earth_radius / 2)
+        self.points = unit_vectors(lat, lon)
+        keys = self.keys(np.floor(self.points / self.cell).astype(np.int64))
+        self.order = np.argsort(keys, kind='stable')
+        self.keys_sorted = keys[self.order]
+        self.points = self.points[self.order]
+
+
+    def keys (self, cells):
+
+        # This code packs the three integer coordinates of each cube into a single int64 key (21 bits each).
+        cells = cells + (1 << 20)
+        return (cells[:, 0] << 42) | (cells[:, 1] << 21) | cells[:, 2]
+
+
+    def distances (self, lat, lon):
+
+        # This code finds every (office, venue) pair closer than 'max_radius' and returns the office positions and the distances in meters of those pairs.
+        # Each of the 27 neighbouring cubes is looked up for all the offices at once with np.searchsorted on the sorted cube keys.
+        offices = unit_vectors(lat, lon)
+        cells = np.floor(offices / self.cell).astype(np.int64)
+        office_idx, venue_idx = [], []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for dz in (-1, 0, 1):
+                    keys = self.keys(cells + np.array([dx, dy, dz]))
+                    start = np.searchsorted(self.keys_sorted, keys, side='left')
+                    end = np.searchsorted(self.keys_sorted, keys, side='right')
+                    n = end - start
+                    if n.sum() == 0:
+                        continue
+                    rows = np.repeat(np.arange(len(offices)), n)
+                    office_idx.append(rows)
+                    venue_idx.append(np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n) + np.repeat(start, n))
+        if not office_idx:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        office_idx, venue_idx = np.concatenate(office_idx), np.concatenate(venue_idx)
+        chord = np.linalg.norm(offices[office_idx] - self.points[venue_idx], axis=1)
+        distance = 2 * earth_radius * np.arcsin(np.minimum(chord / 2, 1))
+        near = distance <= self.max_radius
+
+        return office_idx[near], distance[near]
+
+
+    def count (self, lat, lon, radii, chunk_size=10000):
+
+        # This code counts the venues within each radius of 'radii' (at most 'max_radius') around every office.
+        # Returns an array with one row per office and one column per radius. The offices are processed in chunks of 'chunk_size' to bound the memory.
+        radii = np.atleast_1d(np.asarray(radii, dtype='float64'))
+        if (radii > self.max_radius).any():
+            raise ValueError(f"radii must be at most max_radius ({self.max_radius} m)")
+        lat, lon = np.atleast_1d(lat), np.atleast_1d(lon)
+        counts = np.zeros((len(lat), len(radii)), dtype=np.int64)
+        for start in range(0, len(lat), chunk_size):
+            office_idx, distance = self.distances(lat[start:start + chunk_size], lon[start:start + chunk_size])
+            for j, radius in enumerate(radii):
+                counts[start:start + chunk_size, j] = np.bincount(office_idx[distance <= radius], minlength=len(lat[start:start + chunk_size]))
+
+        return counts
+
+
+
+def venue_coordinates (df, column):
+
+    # This function collects the coordinates of the venues of one category fetched for all the offices ('geocodes.main', as read by pre_explode).
+    # Venues fetched for more than one office are kept once, using their fsq_id.
+    venues = {}
+    for results in df[column]:
+        for venue in results:
+            venues[venue.get('fsq_id', id(venue))] = (venue["geocodes"]["main"]["latitude"], venue["geocodes"]["main"]["longitude"])
+    coords = np.array(list(venues.values()), dtype='float64').reshape(-1, 2)
+
+    return coords[:, 0], coords[:, 1]
+
+
+
+def build_indexes (df, columns=("vegan_rest", "preschool", "starbucks", "clubs"), max_radius=1000):
+
+    # This function builds one VenueIndex per category over the venues fetched by matching_companies.
+    indexes = {}
+    for column in columns:
+        lat, lon = venue_coordinates(df, column)
+        indexes[column] = VenueIndex(lat, lon, max_radius)
+
+    return indexes
+
+
+
+def radius_counts (df, indexes, radii=(500,)):
+
+    # This function counts, for every office of df, the venues of each category within each radius, without calling the Foursquare API.
+    # Returns a DataFrame with the same index as df and one 'num_<category>_<radius>' column per category and radius.
+    # Only the venues that were fetched are indexed, so the counts for radii larger than the fetch radius are lower bounds.
+    radii = list(np.atleast_1d(radii))
+    lat, lon = df['offices_latitude'].to_numpy(dtype='float64'), df['offices_longitude'].to_numpy(dtype='float64')
+    result = {}
+    for column, index in indexes.items():
+        counts = index.count(lat, lon, radii)
+        for j, radius in enumerate(radii):
+            result[f"num_{column}_{radius:g}"] = counts[:, j]
+
+    return pd.DataFrame(result, index=df.index)
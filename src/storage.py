@@ -0,0 +1,85 @@
+import ast
+import os
+import pandas as pd
+import pyarrow.feather as feather
+import pyarrow.parquet as parquet
+import src.cleaning as clean
+
+
+
+venue_columns = tuple(clean.categories)
+
+
+
+def normalize_results (df, columns=venue_columns):
+
+    # This function splits the output of matching_companies into two flat tables, instead of keeping the raw lists of venues inside the cells:
+    # - offices: one row per office with every column except the lists of venues, keyed by 'office_id' (the index of df).
+    # - venues: one row per (office, venue) with office_id, category, fsq_id, latitude, longitude and distance (in meters from the office).
+    columns = [column for column in columns if column in df.columns]
+    offices = df.drop(columns=columns)
+    offices = offices.rename_axis('office_id').reset_index()
+
+    venues = clean.flatten_venues(df, columns)
+    venues['fsq_id'] = venues['fsq_id'].astype('category')
+
+    return offices, venues
+
+
+
+def dictionary_encode (df):
+
+    # This code turns every string column into a categorical, which pyarrow writes as a dictionary-encoded column.
+    for column in df.columns:
+        if pd.api.types.is_string_dtype(df[column]) and not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype('category')
+
+    return df
+
+
+
+def save_results (offices, venues, path="data/pipeline", format="parquet"):
+
+    # This function writes the offices and venues tables to 'path' (a directory), as 'offices.<format>' and 'venues.<format>'.
+    # "parquet" gives the smallest files (zstd compressed), while "arrow" writes uncompressed Arrow IPC files that load_results can memory-map.
+    os.makedirs(path, exist_ok=True)
+    for name, df in [("offices", offices), ("venues", venues)]:
+        df = dictionary_encode(df.copy())
+        if format == "parquet":
+            df.to_parquet(os.path.join(path, f"{name}.parquet"), index=False, compression="zstd")
+        elif format == "arrow":
+            df.to_feather(os.path.join(path, f"{name}.arrow"), compression="uncompressed")
+        else:
+            raise ValueError(f"unknown format: {format}")
+
+
+
+def load_results (path="data/pipeline", format="parquet"):
+
+    # This function reads back the offices and venues tables written by save_results, memory-mapping the files instead of copying them into memory first.
+    tables = []
+    for name in ["offices", "venues"]:
+        if format == "parquet":
+            table = parquet.read_table(os.path.join(path, f"{name}.parquet"), memory_map=True)
+        elif format == "arrow":
+            table = feather.read_table(os.path.join(path, f"{name}.arrow"), memory_map=True)
+        else:
+            raise ValueError(f"unknown format: {format}")
+        tables.append(table.to_pandas())
+
+    return tables[0], tables[1]
+
+
+
+def convert_csv (path="data/df_api.csv", output="data/pipeline", format="parquet", columns=venue_columns):
+
+    # This function parses a CSV saved by the notebooks, with the lists of venues stored as Python-repr strings, once with ast.literal_eval,
+    # and saves it as offices and venues tables, so later loads do not need to parse it again.
+    df = pd.read_csv(path)
+    for column in columns:
+        if column in df.columns:
+            df[column] = df[column].apply(lambda x: ast.literal_eval(x) if isinstance(x, str) else [])
+    offices, venues = normalize_results(df, columns)
+    save_results(offices, venues, output, format)
+
+    return offices, venues
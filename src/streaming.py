@@ -0,0 +1,127 @@
+from collections import Counter
+from itertools import islice
+import pandas as pd
+import src.cleaning as clean
+import src.geocoding as geo
+
+
+
+# The bytes that the downstream stages hold per office row, besides what memory_usage counts, measured on data/df_api.csv:
+# the nested office dictionary (memory_usage only counts the shallow size of the dictionary) and, once matching_companies has run, its four lists of venues.
+office_bytes = 1100
+venue_bytes = 68000
+
+
+
+def office_frame (docs):
+
+    # This code turns a list of documents into a DataFrame with one office per row, without the _id used to resume the cursor.
+    df = pd.DataFrame(docs).drop(columns='_id', errors='ignore')
+    df = df.explode('offices')
+    df = df.dropna(subset=['offices'])
+    df = df.reset_index(drop=True)
+
+    return df
+
+
+
+def mongo_stream (c, chunk_size=1000, max_memory=None, row_bytes=office_bytes):
+
+    # This generator reads the same documents as mongo_filter, but fetches them from MongoDB in batches of 'chunk_size' documents (in _id order)
+    # and yields them as small DataFrames with one office per row, so the whole collection is never held in memory.
+    # 'max_memory' is a ceiling in bytes for each yielded chunk, estimated as its memory_usage plus 'row_bytes' per office for what the downstream stages add to it.
+    # A chunk above the ceiling is split in halves until each part fits, and the cursor is reopened after the last document read with the reduced batch size,
+    # so the next batches fetched from MongoDB are smaller too. Only a single document above the ceiling is yielded as it is.
+    condition_1 = {"total_money_raised": {"$regex": "M$"}}
+    condition_2 = {"tag_list": {"$regex": "design"}}
+    query = {"$and": [condition_1, condition_2]}
+    projection = {"name":1, "offices":1, "total_money_raised": 1, "_id":1}
+    last_id = None
+
+    while True:
+        resume = query if last_id is None else {"$and": [condition_1, condition_2, {"_id": {"$gt": last_id}}]}
+        cursor = c.find(resume, projection).sort("_id", 1).batch_size(chunk_size)
+        batch_size = chunk_size
+        while chunk_size == batch_size:
+            docs = list(islice(cursor, chunk_size))
+            if not docs:
+                cursor.close()
+                return
+            last_id = docs[-1]['_id']
+            parts = [docs]
+            while parts:
+                part = parts.pop(0)
+                df = office_frame(part)
+                if max_memory is not None and len(part) > 1 and df.memory_usage(deep=True).sum() + len(df) * row_bytes > max_memory:
+                    half = len(part) // 2
+                    parts[:0] = [part[:half], part[half:]]
+                    chunk_size = min(chunk_size, half)
+                    continue
+                yield df
+        cursor.close()
+
+
+
+def top_codes (c, chunk_size=1000, top_states=4, max_memory=None):
+
+    # This code is the first pass over the collection: it counts the (country, state) pairs of the offices chunk by chunk,
+    # and adds up the coordinates of the offices that have them per (country, state, zip code) with zip_sums, so only counters and sums are kept, whatever the size of the collection.
+    # Returns the most frequent country and the 'top_states' most frequent states of that country, as basic_cleaning_1 and basic_cleaning_2 do,
+    # and the zip-code table that insert_coordinates learns from the offices of those states (the mean coordinates per zip code, as centroids_from_offices in src/geocoding.py).
+    # The table is learned once from the whole collection, so the offices kept by the second pass do not depend on 'chunk_size'.
+    counts = Counter()
+    sums = None
+    for df in mongo_stream(c, chunk_size, max_memory):
+        counts.update(zip(df['offices'].map(lambda x: x.get('country_code')), df['offices'].map(lambda x: x.get('state_code'))))
+        flat = clean.flatten_offices(df['offices']).astype({'offices_country_code': object, 'offices_state_code': object})
+        chunk = geo.zip_sums(flat, by=['offices_country_code', 'offices_state_code'])
+        sums = chunk if sums is None else sums.add(chunk, fill_value=0)
+
+    countries = Counter()
+    for (country, state), n in counts.items():
+        if country:
+            countries[country] += n
+    if not countries:
+        return None, [], None
+    country = countries.most_common(1)[0][0]
+    states = Counter({state: n for (code, state), n in counts.items() if code == country and state})
+    states = [state for state, n in states.most_common(top_states)]
+    sums = sums.reset_index()
+    sums = sums[(sums['offices_country_code'] == country) & sums['offices_state_code'].isin(states)]
+    centroids = geo.centroids_from_sums(sums.groupby('zip_code')[['offices_latitude', 'offices_longitude', 'offices']].sum())
+
+    return country, states, centroids
+
+
+
+def clean_chunk (df, country, states):
+
+    # This code flattens the office fields of one chunk, keeps the offices located in the selected country and states, and then finishes the cleaning with basic_cleaning_3.
+    df = clean.add_office_columns(df)
+    df = df[(df['offices_country_code'] == country) & df['offices_state_code'].isin(states)]
+    df = df.reset_index(drop=True)
+    df = clean.basic_cleaning_3(df)
+
+    return df
+
+
+
+def stream_pipeline (c, chunk_size=1000, top_states=4, max_memory=None, fetch_venues=True, cache_path=None, **venue_kwargs):
+
+    # This generator runs the pipeline chunk by chunk: a first pass over the collection selects the top country and states (top_codes),
+    # and a second pass streams the documents again through cleaning, venue fetching (matching_companies) and scoring (final_punctuation).
+    # Each processed chunk is yielded as soon as it is ready, so the downstream stages can start before the whole collection has been read.
+    # The missing coordinates of each chunk are filled by insert_coordinates with the zip-code table learned by the first pass (and the optional geocode cache 'cache_path'),
+    # and the offices that are still without coordinates are dropped.
+    country, states, centroids = top_codes(c, chunk_size, top_states, max_memory)
+    for df in mongo_stream(c, chunk_size, max_memory, office_bytes + (venue_bytes if fetch_venues else 0)):
+        df = clean_chunk(df, country, states)
+        df = clean.insert_coordinates(df, centroids=centroids, cache_path=cache_path)
+        df = df.dropna(subset=['offices_latitude', 'offices_longitude'])
+        df = df.reset_index(drop=True)
+        if df.empty:
+            continue
+        if fetch_venues:
+            df = clean.matching_companies(df, **venue_kwargs)
+            df = clean.final_punctuation(df)
+        yield df
@@ -1,18 +1,16 @@
-import folium
 import pandas as pd
 import json
 from numpy import median
-from folium import Choropleth, Circle, Marker, Icon, Map
 import ast
-import matplotlib.pyplot as plt
+import numpy as np
 
-import warnings
-warnings.filterwarnings('ignore')
+# folium and matplotlib are imported inside the functions that draw with them, so importing this module (or a batch job that only scores) does not load the plotting stack.
 
 
 
 def pie_plot ():
     
+    import matplotlib.pyplot as plt
     punctuation = {'vegan_rest': 32.0, 'preschool': 20.0, 'starbucks': 28.0, 'club': 20.0}
 
     # Convert the dictionary into a pandas DataFrame
@@ -32,99 +30,95 @@ def pie_plot ():
 
 
 
-def map_plot(df, df_subset_vegan_rest, df_subset_preschool, df_subset_starbucks, df_subset_clubs):
+category_styles = {
+    "Vegan": {"label": "Vegan restaurants", "color": "lightgreen", "icon": "leaf", "hex": "#90ee90"},
+    "Starbucks": {"label": "Starbucks", "color": "darkgreen", "icon": "coffee", "hex": "#006400"},
+    "Preschools": {"label": "Preschools", "color": "blue", "icon": "school", "hex": "#0000ff"},
+    "Clubs": {"label": "Clubs", "color": "darkblue", "icon": "martini-glass", "hex": "#00008b"}
+}
+
+office_colors = ['#ff0000', '#00ff00', '#0000ff', '#20B2AA', '#00CED1']
+
+
+
+def map_plot(df, *near_offices, mode="markers", n_offices=5, radius=500):
     
-    # This code assigns the string values 'Vegan', 'Preschools', 'Starbucks', and 'Clubs' to the 'category_name' column of four different subsets of a dataframe.
-    df_subset_vegan_rest['category_name'] = 'Vegan'
-    df_subset_preschool['category_name'] = 'Preschools'
-    df_subset_starbucks['category_name'] = 'Starbucks'
-    df_subset_clubs['category_name'] = 'Clubs'
-
-    # Concatenates the four dataframes into a single one.
-    near_office = pd.concat([df_subset_vegan_rest, df_subset_preschool, df_subset_starbucks, df_subset_clubs], ignore_index=True)
+    # This code concatenates the venue DataFrames into a single one. They can be the four per-category subsets (explode_vegan, explode_preschool, explode_starbucks and explode_clubs)
+    # or the single long-format DataFrame of explode_venues; both carry the 'category_name' column ('Vegan', 'Preschools', 'Starbucks' or 'Clubs').
+    import folium
+    from folium import Marker, Icon, Map
+    from folium.plugins import FastMarkerCluster
+    near_office = pd.concat(near_offices, ignore_index=True)
     
-    # This code creates a map with different feature groups for each category of location (vegan restaurants, Starbucks, preschools, clubs).  
+    # This code creates a map with one layer for each category of location (vegan restaurants, Starbucks, preschools, clubs), labelled with its number of venues.
+    # The venues of each category are drawn according to 'mode':
+    # - "markers": one Marker with its own Icon per venue (fine for a few hundred venues).
+    # - "cluster": one FastMarkerCluster per category, built on the browser from the array of coordinates (scales to tens of thousands of venues).
+    # - "geojson": one GeoJson layer of small circle markers per category, built from the arrays of coordinates.
+    # The venues are grouped by category once, instead of scanning near_office once per category.
     office_nearby = Map(location = [40.749376, -73.995323], zoom_start = 11.4)
-    vegan_group = folium.FeatureGroup(name = f"Vegan restaurants ({near_office[near_office['category_name'] == 'Vegan'].shape[0]})")
-    starbucks_group = folium.FeatureGroup(name = f"Starbucks ({near_office[near_office['category_name'] == 'Starbucks'].shape[0]})")
-    preschool_group = folium.FeatureGroup(name = f"Preschools ({near_office[near_office['category_name'] == 'Preschools'].shape[0]})")
-    clubs_group = folium.FeatureGroup(name = f"Clubs ({near_office[near_office['category_name'] == 'Clubs'].shape[0]})")
-
-    # This code iterates through each row in the "near_office" dataframe and creates a dictionary called "company" containing the location and tooltip of each row. 
-    # Based on the value of the "category_name" column in each row, it assigns a different color and icon to the "icon" variable. 
-    # Creates a new marker with the location and icon properties, and adds it to the corresponding feature group (e.g., vegan, Starbucks, etc.). 
-    # Adds all the feature groups to the "office_nearby" map.
-    for index, row in near_office.iterrows():
-
-        company = {
-            "location": [row["latitude"], row["longitude"]],
-            "tooltip": row["category_name"]
-                 }
-
-
-        if row["category_name"] == "Vegan":
-            icon = Icon (
-                color = "lightgreen",
-                prefix="fa",
-                icon="leaf"
-                )
-            
-        elif row["category_name"] == "Starbucks":
-            icon = Icon (
-                color = "darkgreen",
-                prefix="fa",
-                icon="coffee"
-                )
-            
-        elif row["category_name"] == "Preschools":
-            icon = Icon (
-                color = "blue",
-                prefix="fa",
-                icon="school"
-                )
-            
-        elif row["category_name"] == "Clubs":
-            icon = Icon (
-                color = "darkblue",
-                prefix="fa",
-                icon="martini-glass"
-                )
-
-
-        new_marker = Marker (**company, icon = icon)
- 
-        if row["category_name"] == "Vegan":
-            new_marker.add_to(vegan_group)
-        
-        elif row["category_name"] == "Starbucks":
-            new_marker.add_to(starbucks_group)
-        
-        elif row["category_name"] == "Preschools":
-            new_marker.add_to(preschool_group)
-        
-        elif row["category_name"] == "Clubs":
-            new_marker.add_to(clubs_group)
-
-
-    vegan_group.add_to(office_nearby)
-    starbucks_group.add_to(office_nearby)
-    preschool_group.add_to(office_nearby)
-    clubs_group.add_to(office_nearby)
-
-    # This code adds five Circle markers to the office_nearby map, each representing a different office location. 
-    # It also adds a LayerControl to the map to allow toggling of the various feature groups.
+    groups = {category: venues.to_numpy(dtype='float64') for category, venues in near_office[['latitude', 'longitude']].groupby(near_office['category_name'].astype(str))}
+    for category, style in category_styles.items():
+        coords = groups.get(category, np.empty((0, 2)))
+        name = f"{style['label']} ({len(coords)})"
+
+        if mode == "markers":
+            group = folium.FeatureGroup(name = name)
+            for lat, lon in coords:
+                icon = Icon (color = style["color"], prefix="fa", icon=style["icon"])
+                Marker (location = [lat, lon], tooltip = category, icon = icon).add_to(group)
+
+        elif mode == "cluster":
+            group = FastMarkerCluster(coords.tolist(), name = name)
+
+        elif mode == "geojson":
+            features = {"type": "FeatureCollection",
+                        "features": [{"type": "Feature", "geometry": {"type": "Point", "coordinates": point}, "properties": {}} for point in coords[:, ::-1].tolist()]}
+            group = folium.GeoJson(features, name = name, tooltip = category,
+                                   marker = folium.CircleMarker(radius = 4, weight = 1, color = style["hex"], fill = True, fill_opacity = 0.8))
+
+        else:
+            raise ValueError(f"unknown mode: {mode}")
+
+        group.add_to(office_nearby)
+
+    # This code adds one Circle of 'radius' meters for each of the first 'n_offices' offices of df (all of them when 'n_offices' is None). 
+    # It also adds a LayerControl to the map to allow toggling of the various layers.
     folium.LayerControl(collapsed=False, position="topleft").add_to(office_nearby)
     
     df = df.reset_index(drop=True)
+    offices = df if n_offices is None else df.head(n_offices)
+    for i, (lat, lon) in enumerate(offices[['offices_latitude', 'offices_longitude']].to_numpy(dtype='float64')):
+        folium.Circle(location=[lat, lon], popup=f"Point {i + 1}", fill_color=office_colors[i % len(office_colors)], radius=radius, weight=2, color="#000000").add_to(office_nearby)
 
-    p1_lat_NY, p1_lon_NY, p2_lat_NY, p2_lon_NY, p3_lat_NY, p3_lon_NY = df['offices_latitude'][0], df['offices_longitude'][0], df['offices_latitude'][1], df['offices_longitude'][1], df['offices_latitude'][2], df['offices_longitude'][2]
-    p1_lat_CA, p1_lon_CA, p2_lat_CA, p2_lon_CA = df['offices_latitude'][3], df['offices_longitude'][3], df['offices_latitude'][4], df['offices_longitude'][4]
+    return office_nearby
 
-    folium.Circle(location=[p1_lat_NY, p1_lon_NY], popup='Point 1A', fill_color='#ff0000', radius=500, weight=2, color="#000000").add_to(office_nearby)
-    folium.Circle(location=[p2_lat_NY, p2_lon_NY], popup='Point 1B', fill_color='#00ff00', radius=500, weight=2, color="#000000").add_to(office_nearby)
-    folium.Circle(location=[p3_lat_NY, p3_lon_NY], popup='Point 1C', fill_color='#0000ff', radius=500, weight=2, color="#000000").add_to(office_nearby)
-    folium.Circle(location=[p1_lat_CA, p1_lon_CA], popup='Point 1D', fill_color='#20B2AA', radius=500, weight=2, color="#000000").add_to(office_nearby)
-    folium.Circle(location=[p2_lat_CA, p2_lon_CA], popup='Point 1E', fill_color='#00CED1', radius=500, weight=2, color="#000000").add_to(office_nearby)
 
-    return office_nearby
 
+def static_plot(df, *near_offices, n_offices=5, radius=500, path=None):
+
+    # This code draws a lightweight static image of the same map with matplotlib: one scatter per category of venue and one circle per office.
+    # The circles are drawn in degrees, using the length of a degree of longitude at the latitude of each office. Saves the image when 'path' is given.
+    import matplotlib.pyplot as plt
+    from matplotlib.patches import Ellipse
+    near_office = pd.concat(near_offices, ignore_index=True)
+    fig, ax = plt.subplots(figsize=(10, 10))
+    groups = {category: venues.to_numpy(dtype='float64') for category, venues in near_office[['latitude', 'longitude']].groupby(near_office['category_name'].astype(str))}
+    for category, style in category_styles.items():
+        coords = groups.get(category, np.empty((0, 2)))
+        ax.scatter(coords[:, 1], coords[:, 0], s=6, color=style["hex"], label=f"{style['label']} ({len(coords)})")
+
+    df = df.reset_index(drop=True)
+    offices = df if n_offices is None else df.head(n_offices)
+    for i, (lat, lon) in enumerate(offices[['offices_latitude', 'offices_longitude']].to_numpy(dtype='float64')):
+        height = radius / 111320
+        width = height / np.cos(np.radians(lat))
+        ax.add_patch(Ellipse((lon, lat), 2 * width, 2 * height, facecolor=office_colors[i % len(office_colors)], alpha=0.3, edgecolor="#000000"))
+
+    ax.set_xlabel('longitude')
+    ax.set_ylabel('latitude')
+    ax.legend(loc='upper left')
+    if path is not None:
+        fig.savefig(path)
+
+    return fig
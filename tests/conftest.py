@@ -0,0 +1,7 @@
+import os
+import sys
+
+
+
+# The tests import the pipeline modules as "src.<module>", like the notebooks do, so the root of the repository must be importable.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
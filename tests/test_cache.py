@@ -0,0 +1,38 @@
+import src.cache as cache
+import src.fetching as fetch
+
+
+
+def test_eviction_keeps_the_most_recent_entries (tmp_path):
+
+    # The cache never holds more than max_entries, replacing an entry does not count it twice, and the count survives reopening the file.
+    path = str(tmp_path / "venue_cache.sqlite")
+    venue_cache = cache.VenueCache(path, max_entries=100)
+    for i in range(150):
+        venue_cache.put("vegan", 40 + i * 1e-4, -73.9, 500, [i])
+    venue_cache.put("vegan", 40 + 149 * 1e-4, -73.9, 500, ["again"])
+    venue_cache.close()
+
+    venue_cache = cache.VenueCache(path, max_entries=100)
+    assert venue_cache.entries == venue_cache.stats()["entries"] == 100
+    assert venue_cache.get("vegan", 40 + 49 * 1e-4, -73.9, 500) is None
+    assert venue_cache.get("vegan", 40 + 50 * 1e-4, -73.9, 500) == [50]
+    assert venue_cache.get("vegan", 40 + 149 * 1e-4, -73.9, 500) == ["again"]
+    venue_cache.close()
+
+
+
+def test_warm_run_keeps_access_times (tmp_path):
+
+    # A run answered entirely from the cache still commits the access times it refreshed, without closing the cache.
+    path = str(tmp_path / "venue_cache.sqlite")
+    venue_cache = cache.VenueCache(path)
+    venue_cache.put("vegan", 40.7, -73.9, 500, [])
+    venue_cache.commit()
+    before = venue_cache.con.execute("SELECT accessed FROM venues").fetchone()[0]
+
+    fetch.fetch_venues([(40.7, -73.9)], {"vegan_rest": "vegan"}, "stub", cache=venue_cache)
+    reader = cache.VenueCache(path)
+    assert reader.con.execute("SELECT accessed FROM venues").fetchone()[0] > before
+    reader.close()
+    venue_cache.close()
@@ -0,0 +1,42 @@
+import ast
+import pandas as pd
+import src.cleaning as clean
+import src.scoring as score
+
+
+
+def venue (fsq_id, lat, lon, name=""):
+
+    return {"fsq_id": fsq_id, "name": name, "distance": 100, "geocodes": {"main": {"latitude": lat, "longitude": lon}}}
+
+
+
+def test_explode_venues_keeps_each_venue_once_per_category ():
+
+    # "a" is found near both offices (kept once), "b" is both a vegan restaurant and a club (kept in both categories),
+    # and "c" and "d" are two different clubs with the same coordinates (both kept).
+    df = pd.DataFrame({"name": ["first", "second"], "offices_state_code": ["NY", "NY"], "offices_latitude": [40.70, 40.71], "offices_longitude": [-74.00, -74.01],
+                       "vegan_rest": [[venue("a", 40.1, -74.1), venue("b", 40.2, -74.2)], [venue("a", 40.1, -74.1)]],
+                       "preschool": [[], []], "starbucks": [[], None],
+                       "clubs": [[venue("b", 40.2, -74.2), venue("c", 40.3, -74.3)], [venue("d", 40.3, -74.3)]]})
+    near_office = clean.explode_venues(df)
+
+    assert list(near_office.columns) == ['name', 'offices_state_code', 'offices_latitude', 'offices_longitude', 'office_id', 'category', 'fsq_id', 'latitude', 'longitude', 'distance', 'category_name']
+    assert near_office.groupby('category', observed=False).size().to_dict() == {"vegan_rest": 2, "preschool": 0, "starbucks": 0, "clubs": 3}
+    assert near_office[['category_name', 'fsq_id', 'name']].values.tolist() == [["Vegan", "a", "first"], ["Vegan", "b", "first"], ["Clubs", "b", "first"], ["Clubs", "c", "first"], ["Clubs", "d", "second"]]
+
+
+
+def test_explode_venues_on_the_saved_results ():
+
+    # On the 5 best offices of data/df_api.csv the old explode_clubs, which dropped the venues with the same coordinates, kept 24 clubs.
+    # explode_venues keeps 25: the clubs "Hue SF" and "College Night" are two venues (two fsq_id) geocoded at the same point (37.797934, -122.404801).
+    df = pd.read_csv("data/df_api.csv")
+    for column in clean.categories:
+        df[column] = df[column].apply(lambda x: ast.literal_eval(x) if isinstance(x, str) else [])
+    near_office = clean.explode_venues(score.select(clean.final_punctuation(df), k=5))
+
+    assert near_office.groupby('category_name').size().to_dict() == {"Clubs": 25, "Preschools": 7, "Starbucks": 30, "Vegan": 39}
+    clubs = near_office[near_office['category'] == 'clubs']
+    assert len(clubs.drop_duplicates(subset=['latitude', 'longitude'])) == 24
+    assert clubs.loc[(clubs['latitude'] == 37.797934) & (clubs['longitude'] == -122.404801), 'fsq_id'].nunique() == 2
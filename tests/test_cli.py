@@ -0,0 +1,41 @@
+import os
+import subprocess
+import sys
+import pandas as pd
+import pytest
+import src.cli as cli
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+
+def test_convert_score_render (tmp_path, capsys):
+
+    # The stages that do not need MongoDB or the API, run one after the other on data/df_api.csv.
+    pytest.importorskip("folium")
+    pytest.importorskip("matplotlib")
+    pipeline, scored = str(tmp_path / "pipeline"), str(tmp_path / "scored.csv")
+    cli.main(["convert", "--input", os.path.join(root, "data/df_api.csv"), "--output", pipeline])
+    cli.main(["score", "--input", pipeline, "--output", scored])
+    for output in ["map.html", "map.png"]:
+        cli.main(["render", "--input", pipeline, "--scored", scored, "--output", str(tmp_path / output)])
+
+    df_subset = pd.read_csv(scored)
+    assert len(df_subset) == 5
+    assert df_subset['weighted_punct'].is_monotonic_decreasing
+    assert (tmp_path / "map.html").stat().st_size > 0 and (tmp_path / "map.png").stat().st_size > 0
+    assert "22 offices, 269 venues" in capsys.readouterr().out
+
+
+
+def test_score_does_not_load_the_heavy_modules (tmp_path):
+
+    # The score stage, in a fresh interpreter: neither the API client, the plotting stack nor the MongoDB driver are imported.
+    pipeline = str(tmp_path / "pipeline")
+    code = ("import sys; import src.cli as cli; "
+            f"cli.main(['convert', '--input', 'data/df_api.csv', '--output', {pipeline!r}]); "
+            f"cli.main(['score', '--input', {pipeline!r}, '--output', {str(tmp_path / 'scored.csv')!r}]); "
+            "print(sorted(m for m in ['requests', 'folium', 'matplotlib', 'pymongo'] if m in sys.modules))")
+    result = subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True, check=True)
+
+    assert result.stdout.strip().splitlines()[-1] == "[]"
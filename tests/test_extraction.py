@@ -0,0 +1,51 @@
+import random
+import numpy as np
+import pandas as pd
+import pytest
+import src.cleaning as clean
+import src.extraction as extraction
+
+mongomock = pytest.importorskip("mongomock")
+
+
+
+def companies (n=400, seed=0):
+
+    # This code fills an in-memory "companies" collection with documents that exercise the corner cases of the cleaning:
+    # companies without offices, foreign offices without state, and empty strings or missing values in every office field.
+    rng = random.Random(seed)
+    c = mongomock.MongoClient().db.companies
+    states = ["NY", "CA", "FL", "IL", "TX", "WA", "MA"]
+    countries = ["USA"] * 8 + ["GBR", "DEU"]
+    docs = []
+    for i in range(n):
+        offices = []
+        for j in range(rng.randint(0, 3)):
+            country = rng.choice(countries)
+            offices.append({"country_code": country, "state_code": rng.choice(states[:rng.randint(1, 7)]) if country == "USA" else None,
+                            "latitude": rng.choice([None, round(rng.uniform(30, 45), 4)]), "longitude": rng.choice([None, round(rng.uniform(-120, -70), 4)]),
+                            "address1": rng.choice(["", "1 Main St"]), "address2": rng.choice(["", "Floor 2"]), "zip_code": rng.choice(["", "10001"])})
+        docs.append({"name": f"company {i}", "total_money_raised": rng.choice(["$1M", "$3k", "$20M"]), "tag_list": rng.choice(["design, web", "web"]), "offices": offices})
+    c.insert_many(docs)
+
+    return c
+
+
+
+def comparable (df):
+
+    # This code gives both results the same column types (plain objects, with NaN for the missing values) and the same row order.
+    df = df.astype(object).where(df.notna(), np.nan)
+    return df.sort_values(list(df.columns), key=lambda x: x.astype(str)).reset_index(drop=True)
+
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2, 3])
+def test_mongo_aggregate_matches_pandas_cleaning (seed):
+
+    c = companies(seed=seed)
+    expected = clean.basic_cleaning_3(clean.basic_cleaning_2(clean.basic_cleaning_1(clean.mongo_filter(c))))
+    result = extraction.mongo_aggregate(c)
+
+    assert len(result) > 0
+    pd.testing.assert_frame_equal(comparable(result[expected.columns]), comparable(expected))
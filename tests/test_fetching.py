@@ -0,0 +1,112 @@
+import time
+from urllib.parse import unquote
+import numpy as np
+import pandas as pd
+import pytest
+import src.benchmark as bench
+import src.cache as cache
+import src.fetching as fetch
+
+
+
+@pytest.fixture(scope="module")
+def url ():
+
+    # The stub Foursquare server of the benchmarks, with 50 ms of latency per request.
+    with bench.stub_server(0.05) as url:
+        yield url
+
+
+
+def offices (n=10, seed=0):
+
+    rng = np.random.default_rng(seed)
+    return list(zip(rng.uniform(40.70, 40.80, n), rng.uniform(-74.02, -73.93, n)))
+
+
+
+def test_fetch_is_concurrent (url):
+
+    # 40 searches of 50 ms each: about 2 s one at a time, and about 0.25 s over 8 workers.
+    coords = offices(10)
+    seconds = []
+    for workers in [1, 8]:
+        start = time.perf_counter()
+        fetch.fetch_venues(coords, bench.queries, "stub", max_workers=workers, url=url)
+        seconds.append(time.perf_counter() - start)
+
+    assert seconds[0] / seconds[1] > 3
+
+
+
+def test_fetch_keeps_order (url):
+
+    # Each list of venues must be the answer of the search of its own category and office, whatever order the searches completed in.
+    coords = offices(10)
+    venues = fetch.fetch_venues(coords, bench.queries, "stub", max_workers=8, url=url)
+
+    assert list(venues) == list(bench.queries)
+    for column, query in bench.queries.items():
+        assert venues[column] == [bench.stub_venues(unquote(query), lat, lon, 500) for lat, lon in coords]
+
+
+
+def test_fetch_error_names_the_search (url):
+
+    with pytest.raises(fetch.FetchError, match="query='vegan'.*401"):
+        fetch.fetch_venues(offices(2), {"vegan_rest": "vegan"}, "invalid", url=url)
+
+
+
+def test_fetch_retries_rate_limited_searches (url):
+
+    coords = offices(3)
+    venues = fetch.fetch_venues(coords, {"throttled": "throttled"}, "stub", url=url)
+
+    assert venues["throttled"] == [bench.stub_venues("throttled", lat, lon, 500) for lat, lon in coords]
+
+
+
+def test_fetch_caches_results_of_a_failed_batch (tmp_path, monkeypatch):
+
+    # One search out of 40 fails: the error is raised, but the 39 results that came back are stored, and the next run only repeats the failed search.
+    coords = offices(10)
+    failing = coords[3]
+    calls = []
+
+    def request_venue (session, venue, lat, lon, radius, timeout=10, url=None, limit=None):
+        calls.append((venue, lat, lon))
+        if (lat, lon) == failing and venue == "vegan":
+            raise fetch.FetchError("timeout")
+        return bench.stub_venues(unquote(venue), lat, lon, radius)
+
+    monkeypatch.setattr(fetch, "request_venue", request_venue)
+    venue_cache = cache.VenueCache(str(tmp_path / "venue_cache.sqlite"))
+    with pytest.raises(fetch.FetchError):
+        fetch.fetch_venues(coords, bench.queries, "stub", cache=venue_cache)
+    assert venue_cache.stats()["entries"] == 39
+
+    failing = None
+    calls.clear()
+    fetch.fetch_venues(coords, bench.queries, "stub", cache=venue_cache)
+    assert calls == [("vegan", *coords[3])]
+    venue_cache.close()
+
+
+
+@pytest.mark.parametrize("limit", [50, 5])
+def test_coalesced_venues_match_naive (url, limit):
+
+    # The offices of the saved pipeline outputs and some random ones. With a limit of 5 most cluster searches are truncated, so the fallback to per-office searches is exercised too.
+    df = pd.concat([pd.read_csv(path)[['offices_latitude', 'offices_longitude']] for path in ["data/df_api.csv", "data/df_mongo.csv"]]).dropna()
+    coords = list(zip(df['offices_latitude'], df['offices_longitude'])) + offices(20, seed=1)
+    naive = fetch.fetch_venues(coords, bench.queries, "stub", max_workers=16, url=url)
+    coalesced, report = fetch.fetch_venues_coalesced(coords, bench.queries, "stub", limit=limit, max_workers=16, url=url)
+
+    for column in bench.queries:
+        assert [len(x) for x in coalesced[column]] == [len(x) for x in naive[column]]
+        assert [sorted(v["fsq_id"] for v in x) for x in coalesced[column]] == [sorted(v["fsq_id"] for v in x) for x in naive[column]]
+    if limit == 50:
+        assert report["calls"] < report["calls_naive"]
+    else:
+        assert report["fallbacks"] > 0
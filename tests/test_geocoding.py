@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import src.cleaning as clean
+import src.geocoding as geo
+
+
+
+def offices ():
+
+    return pd.DataFrame({"offices_address_1": ["1 Main St", "1 Main St.", "2 Side St", "3 Other Rd"], "offices_address_2": ["", "", "", ""],
+                         "offices_zip_code": ["10001", "10001", "10001-5602", "94111"],
+                         "offices_latitude": [np.nan, np.nan, 40.75, np.nan], "offices_longitude": [np.nan, np.nan, -73.99, np.nan]})
+
+
+
+def test_nothing_is_guessed_without_centroids_or_geocoder ():
+
+    df = geo.backfill_coordinates(offices(), cache_path=None)
+
+    assert df['offices_latitude'].isna().sum() == 3
+
+
+
+def test_backfill_uses_the_given_centroids ():
+
+    centroids = pd.DataFrame({"latitude": [40.0], "longitude": [-74.0]}, index=pd.Index(["94111"], name="zip_code"))
+    df = geo.backfill_coordinates(offices(), centroids=pd.concat([centroids, geo.centroids_from_offices(offices())]), cache_path=None)
+
+    assert df['offices_latitude'].tolist() == [40.75, 40.75, 40.75, 40.0]
+
+
+
+def test_geocoder_is_called_once_per_address_and_cached (tmp_path):
+
+    sent = []
+
+    def geocoder (addresses):
+        sent.append(list(addresses.index))
+        return pd.DataFrame({"latitude": 1.0, "longitude": 2.0}, index=addresses.index)
+
+    for _ in range(2):
+        df = geo.backfill_coordinates(offices(), geocoder=geocoder, cache_path=str(tmp_path / "cache" / "geocode_cache.sqlite"))
+
+    assert sent == [["1 main st 10001", "3 other rd 94111"]]
+    assert df['offices_latitude'].notna().all()
+
+
+
+def test_cache_is_opt_in (tmp_path, monkeypatch):
+
+    # With the defaults nothing is read from or written to disk, whatever the working directory.
+    monkeypatch.chdir(tmp_path)
+    df = clean.insert_coordinates(offices())
+
+    assert df['offices_latitude'].tolist() == [40.75, 40.75, 40.75]
+    assert list(tmp_path.iterdir()) == []
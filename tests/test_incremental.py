@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+import src.benchmark as bench
+import src.cleaning as clean
+import src.incremental as incremental
+
+
+
+def test_refresh_matches_a_full_run (tmp_path):
+
+    # A first run, then a refresh after some offices moved, others were removed and a new one was added:
+    # the refreshed counts and scores must equal those of a full run over the new offices.
+    c = bench.StubCollection(bench.synthetic_companies(150))
+    df = clean.insert_coordinates(clean.basic_cleaning_3(clean.basic_cleaning_2(clean.basic_cleaning_1(clean.mongo_filter(c)))), cache_path=None)
+    moved = np.random.default_rng(0).random(len(df)) < 0.2
+    refreshed = df.assign(offices_latitude=df['offices_latitude'] + moved * 0.01).iloc[3:]
+    refreshed = pd.concat([refreshed, df.iloc[:1].assign(name="new company")], ignore_index=True)
+    state = str(tmp_path / "state.pkl")
+    columns = ['weighted_punct', *[f'num_{column}' for column in clean.categories]]
+
+    with bench.stub_server(0.0) as url:
+        incremental.incremental_matching(df.copy(), state, url=url)
+        result = incremental.incremental_matching(refreshed.copy(), state, url=url)
+        full = clean.final_punctuation(clean.matching_companies(refreshed.copy(), url=url))
+
+    assert result.attrs['incremental_report'] == {"new": 1, "moved": int(moved[3:].sum()), "unchanged": int((~moved[3:]).sum()), "removed": 3}
+    pd.testing.assert_frame_equal(result.sort_index()[columns], full.sort_index()[columns])
@@ -0,0 +1,36 @@
+import src.benchmark as bench
+import src.cache as cache
+import src.cleaning as clean
+import src.fetching as fetch
+import src.instrumentation as instrumentation
+
+
+
+def test_cache_hits_are_not_api_calls (tmp_path):
+
+    venue_cache = cache.VenueCache(str(tmp_path / "venue_cache.sqlite"))
+    coords = [(40.75 + i * 0.01, -73.99) for i in range(5)]
+    for lat, lon in coords:
+        venue_cache.put("vegan", lat, lon, 500, bench.stub_venues("vegan", lat, lon, 500))
+
+    with instrumentation.trace():
+        for lat, lon in coords:
+            clean.function_venue("vegan", lat, lon, 500, cache=venue_cache)
+    summary = instrumentation.summary()
+    venue_cache.close()
+
+    assert summary["api"] == {"calls": 0}
+    assert summary["cache"]["hits"] == 5
+    assert summary["functions"].loc["src.cleaning.function_venue", "calls"] == 5
+
+
+
+def test_every_search_is_one_api_call ():
+
+    coords = [(40.75 + i * 0.01, -73.99) for i in range(5)]
+    with bench.stub_server(0.01) as url, instrumentation.trace():
+        fetch.fetch_venues(coords, bench.queries, "stub", url=url)
+    summary = instrumentation.summary()
+
+    assert summary["api"]["calls"] == len(coords) * len(bench.queries)
+    assert summary["api"]["p50"] >= 0.01
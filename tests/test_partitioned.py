@@ -0,0 +1,50 @@
+import pytest
+import src.benchmark as bench
+import src.cleaning as clean
+import src.partitioned as partitioned
+import src.visualization as viz
+
+
+
+@pytest.fixture(scope="module")
+def url ():
+
+    with bench.stub_server(0.0) as url:
+        yield url
+
+
+
+@pytest.fixture(scope="module")
+def offices ():
+
+    c = bench.StubCollection(bench.synthetic_companies(600))
+    return clean.basic_cleaning_1(clean.mongo_filter(c))
+
+
+
+def test_partitionings_keep_the_same_offices (url, offices):
+
+    # The offices without coordinates are backfilled before the split, so the grid partitioning keeps as many offices as the sequential run and the state partitioning.
+    sequential = clean.final_punctuation(clean.matching_companies(clean.insert_coordinates(clean.basic_cleaning_3(offices.copy()), cache_path=None), url=url))
+    results = {by: partitioned.run_partitioned(offices.copy(), by=by, workers=2, url=url) for by in ["state", "grid"]}
+
+    for by, (scored, df_subset, near_office) in results.items():
+        assert len(scored) == len(sequential)
+        assert scored['weighted_punct'].tolist() == sequential['weighted_punct'].tolist()
+        assert df_subset['weighted_punct'].tolist() == sequential['weighted_punct'].head(5).tolist()
+
+
+
+def test_empty_results (url, offices, tmp_path):
+
+    # No office at all, and offices without any venue within 1 meter. The empty results must still be drawn by map_plot and static_plot.
+    pytest.importorskip("folium")
+    pytest.importorskip("matplotlib")
+    results = [partitioned.run_partitioned(offices.iloc[:0].copy(), workers=1, url=url), partitioned.run_partitioned(offices.head(50).copy(), workers=1, url=url, radius=1)]
+    assert all(x.empty for x in results[0])
+    assert len(results[1][1]) == 5 and results[1][2].empty
+
+    for i, (scored, df_subset, near_office) in enumerate(results):
+        assert {'category_name', 'latitude', 'longitude', 'office_uid'} <= set(near_office.columns)
+        viz.map_plot(df_subset, near_office).save(str(tmp_path / f"map_{i}.html"))
+        viz.static_plot(df_subset, near_office, path=str(tmp_path / f"map_{i}.png"))
@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+import src.cleaning as clean
+import src.scoring as score
+
+
+
+def test_registry_keys_match ():
+
+    # The queries, punctuations, weights, count columns and map names all come from the same registry, keyed by the column of venues.
+    assert list(clean.categories) == list(clean.punctuation) == list(clean.weights) == list(score.score_columns) == list(clean.category_names) == list(score.categories)
+
+
+
+def test_final_punctuation_matches_saved_scores ():
+
+    # The scores of the saved pipeline output, computed by the original row-wise function_weighted_punct.
+    df = pd.read_csv("data/df_api.csv")
+    expected = df['weighted_punct'].to_numpy()
+    scored = clean.final_punctuation(df.drop(columns='weighted_punct'))
+
+    np.testing.assert_allclose(scored.sort_index()['weighted_punct'].to_numpy(), expected)
+
+
+
+def test_final_punctuation_reads_weights_at_call_time (monkeypatch):
+
+    df = pd.read_csv("data/df_api.csv")
+    monkeypatch.setattr(clean, "weights", {"vegan_rest": 0, "preschool": 0, "starbucks": 0, "clubs": 1})
+    scored = clean.final_punctuation(df)
+
+    np.testing.assert_array_equal(scored['weighted_punct'].to_numpy(), scored['num_clubs'].to_numpy())
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+import src.fetching as fetch
+import src.spatial as spatial
+
+
+
+@pytest.mark.parametrize("centre", [(40.75, -73.99), (0.0, 179.99), (89.99, 10.0)])
+def test_counts_match_brute_force (centre):
+
+    # Around New York, across the antimeridian and next to the pole: the counts of the index must equal those of the haversine distance to every venue.
+    rng = np.random.default_rng(0)
+    lat = np.clip(centre[0] + rng.normal(0, 0.01, 3000), -90, 90)
+    lon = (centre[1] + rng.normal(0, 0.01, 3000) + 180) % 360 - 180
+    office_lat = np.clip(centre[0] + rng.normal(0, 0.01, 200), -90, 90)
+    office_lon = (centre[1] + rng.normal(0, 0.01, 200) + 180) % 360 - 180
+    radii = [100, 250, 500, 1000]
+
+    counts = spatial.VenueIndex(lat, lon, max_radius=1000).count(office_lat, office_lon, radii, chunk_size=64)
+    distance = fetch.haversine(office_lat[:, None], office_lon[:, None], lat[None, :], lon[None, :])
+    expected = np.stack([(distance <= radius).sum(axis=1) for radius in radii], axis=1)
+
+    assert counts.sum() > 0
+    np.testing.assert_array_equal(counts, expected)
+
+
+
+def test_radii_above_max_radius_are_rejected ():
+
+    with pytest.raises(ValueError):
+        spatial.VenueIndex([40.75], [-73.99], max_radius=500).count([40.75], [-73.99], [1000])
@@ -0,0 +1,31 @@
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as parquet
+import pytest
+import src.storage as storage
+
+
+
+@pytest.mark.parametrize("format", ["parquet", "arrow"])
+def test_convert_and_load_round_trip (tmp_path, format):
+
+    # data/df_api.csv holds 22 offices and 269 venues. What load_results reads back is what convert_csv wrote, with the string columns dictionary-encoded,
+    # and every venue points through office_id to the office it was found for, as many times as that office's num_<category> count.
+    offices, venues = storage.convert_csv("data/df_api.csv", str(tmp_path), format)
+    loaded_offices, loaded_venues = storage.load_results(str(tmp_path), format)
+    assert (len(offices), len(venues)) == (22, 269)
+
+    for df, loaded in [(offices, loaded_offices), (venues, loaded_venues)]:
+        assert list(loaded.columns) == list(df.columns)
+        assert loaded.astype(object).where(loaded.notna(), None).values.tolist() == df.astype(object).where(df.notna(), None).values.tolist()
+
+    read = parquet.read_schema if format == "parquet" else lambda path: feather.read_table(path).schema
+    for name, columns in [("offices", ['name', 'offices_state_code', 'offices_zip_code']), ("venues", ['category', 'fsq_id'])]:
+        schema = read(str(tmp_path / f"{name}.{format}"))
+        assert all(pa.types.is_dictionary(schema.field(column).type) for column in columns)
+        assert pa.types.is_floating(schema.field('offices_latitude' if name == "offices" else 'latitude').type)
+
+    assert loaded_venues['office_id'].isin(loaded_offices['office_id']).all()
+    counts = loaded_venues.groupby(['office_id', 'category'], observed=False).size().unstack().reindex(loaded_offices['office_id'], fill_value=0)
+    for category in counts.columns:
+        assert counts[category].to_dict() == loaded_offices.set_index('office_id')[f"num_{category}"].to_dict()
@@ -0,0 +1,51 @@
+import pandas as pd
+import pytest
+import src.benchmark as bench
+import src.cleaning as clean
+import src.streaming as streaming
+
+
+
+def offices (chunks):
+
+    return pd.concat(chunks, ignore_index=True)['offices'].tolist()
+
+
+
+@pytest.mark.parametrize("max_memory", [300000, 2000000])
+def test_max_memory_is_a_ceiling (max_memory):
+
+    # Every chunk fits under the ceiling, counting what the downstream stages add per office, and no office is lost, repeated or reordered by the splits.
+    c = bench.StubCollection(bench.synthetic_companies(1000))
+    chunks = list(streaming.mongo_stream(c, 500, max_memory, row_bytes=streaming.office_bytes + streaming.venue_bytes))
+
+    for df in chunks:
+        assert df.memory_usage(deep=True).sum() + len(df) * (streaming.office_bytes + streaming.venue_bytes) <= max_memory
+    assert offices(chunks) == offices(streaming.mongo_stream(c, 500))
+
+
+
+def test_mongo_stream_resumes_a_real_cursor ():
+
+    # The same with a mongomock collection, whose cursors are reopened after the last _id read when the chunks shrink.
+    mongomock = pytest.importorskip("mongomock")
+    c = mongomock.MongoClient().db.companies
+    c.insert_many(bench.synthetic_companies(300))
+    chunks = list(streaming.mongo_stream(c, 200, 100000))
+    unbounded = list(streaming.mongo_stream(c, 200))
+
+    assert len(chunks) > len(unbounded)
+    assert offices(chunks) == offices(unbounded)
+
+
+
+@pytest.mark.parametrize("chunk_size", [50, 300, 5000])
+def test_stream_pipeline_matches_batch (chunk_size):
+
+    # The offices kept by the streamed pipeline, and their backfilled coordinates, must not depend on the chunk size.
+    c = bench.StubCollection(bench.synthetic_companies(2000, seed=1))
+    batch = clean.insert_coordinates(clean.basic_cleaning_3(clean.basic_cleaning_2(clean.basic_cleaning_1(clean.mongo_filter(c)))), cache_path=None)
+    streamed = pd.concat(streaming.stream_pipeline(c, chunk_size, fetch_venues=False, cache_path=None), ignore_index=True)
+
+    columns = ['name', 'offices_address_1', 'offices_zip_code', 'offices_latitude', 'offices_longitude']
+    pd.testing.assert_frame_equal(streamed[columns].astype(object), batch[columns].astype(object))
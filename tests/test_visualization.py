@@ -0,0 +1,29 @@
+import ast
+import pandas as pd
+import pytest
+import src.cleaning as clean
+import src.scoring as score
+import src.visualization as viz
+
+
+
+def test_each_layer_draws_the_venues_of_its_category ():
+
+    # The layers of map_plot and the scatters of static_plot hold the venues of their own category, in the order of near_office.
+    pytest.importorskip("folium")
+    pytest.importorskip("matplotlib")
+    df = pd.read_csv("data/df_api.csv")
+    for column in clean.categories:
+        df[column] = df[column].apply(lambda x: ast.literal_eval(x) if isinstance(x, str) else [])
+    df_subset = score.select(clean.final_punctuation(df), k=5)
+    near_office = clean.explode_venues(df_subset)
+    expected = {category: near_office.loc[near_office['category_name'] == category, ['latitude', 'longitude']].values.tolist() for category in viz.category_styles}
+
+    layers = [layer for layer in viz.map_plot(df_subset, near_office)._children.values() if getattr(layer, 'layer_name', '').endswith(')')]
+    assert [layer.layer_name for layer in layers] == [f"{style['label']} ({len(expected[category])})" for category, style in viz.category_styles.items()]
+    for layer, category in zip(layers, viz.category_styles):
+        assert [marker.location for marker in layer._children.values()] == expected[category]
+
+    scatters = viz.static_plot(df_subset, near_office).axes[0].collections
+    for scatter, category in zip(scatters, viz.category_styles):
+        assert scatter.get_offsets()[:, ::-1].tolist() == expected[category]